@@ -0,0 +1,3 @@
+'''
+Shared helpers for the Face-Object 3AFC sequential/simultaneous tasks
+'''
@@ -0,0 +1,241 @@
+'''
+Multi-subject 3AFC aggregation
+
+Discovers every data/sub-*/sub-*_{sequential,simultaneous}_objafc file,
+loads them in a process pool and concatenates them into one structured
+array (faceobj.results.AFC_DTYPE). The merged table is cached next to the
+data together with each file's mtime and size, so re-running after adding a
+subject only parses the new file. Group summaries are NumPy reductions over
+the merged table.
+
+from faceobj.analysis import load_all, summarize
+trials = load_all('data')
+summarize(trials)
+
+subject_measures() gives the 3AFC confusion structure (correct, lure and
+novel rates, how errors split between lure and novel, RTs) per subject and
+condition; report() adds bootstrap CIs per condition and for the paired
+simultaneous - sequential contrast. All resamples are drawn as one
+(n_boot, n_subjects) index array. From the command line:
+
+python -m faceobj.analysis data --boot 10000 --out report.tsv
+'''
+
+import os
+import sys
+import glob
+import json
+import argparse
+import warnings
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from faceobj.results import AFC_DTYPE, AFC_RESP, CONDITIONS, load_afc, read_trials
+
+CACHE_NAME = '.objafc_cache'
+
+def find_files(data_dir='data'):
+    # one file per subject/condition; a streamed .tsv is used only if its session never compacted
+    files = []
+    for condition in CONDITIONS:
+        for tsv in sorted(glob.glob(os.path.join(data_dir, 'sub-*', f'sub-*_{condition}_objafc.tsv'))):
+            if not os.path.exists(tsv[:-4]+'.npy'):
+                files.append(tsv)
+        files += sorted(glob.glob(os.path.join(data_dir, 'sub-*', f'sub-*_{condition}_objafc.npy')))
+    return sorted(files)
+
+def load_file(fname):
+    if fname.endswith('.tsv'):
+        return read_trials(fname)
+    return np.array(load_afc(fname, mmap=True))
+
+def _stamp(fname):
+    st = os.stat(fname)
+    return [st.st_mtime_ns, st.st_size]
+
+def _read_cache(data_dir):
+    path = os.path.join(data_dir, CACHE_NAME)
+    try:
+        with open(path+'.json') as f:
+            index = json.load(f)
+        table = np.load(path+'.npy', mmap_mode='r', allow_pickle=False)
+    except (OSError, ValueError):
+        return {}, np.zeros(0, dtype=AFC_DTYPE)
+    if table.dtype != AFC_DTYPE:
+        return {}, np.zeros(0, dtype=AFC_DTYPE)
+    return index, table
+
+def _write_cache(data_dir, index, table):
+    path = os.path.join(data_dir, CACHE_NAME)
+    np.save(path+'.tmp.npy', table)
+    with open(path+'.tmp.json', 'w') as f:
+        json.dump(index, f)
+    os.replace(path+'.tmp.npy', path+'.npy')
+    os.replace(path+'.tmp.json', path+'.json')
+
+def load_all(data_dir='data', workers=None, use_cache=True):
+    '''
+    Structured array of every 3AFC trial under data_dir. Files whose mtime and
+    size match the cache are sliced out of it; the rest are parsed in parallel.
+    '''
+    files = find_files(data_dir)
+    index, table = _read_cache(data_dir) if use_cache else ({}, np.zeros(0, dtype=AFC_DTYPE))
+    rel = {f: os.path.relpath(f, data_dir) for f in files}
+    stale = [f for f in files if rel[f] not in index or index[rel[f]]['stamp'] != _stamp(f)]
+    if len(stale) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parsed = dict(zip(stale, pool.map(load_file, stale)))
+    else:
+        parsed = {f: load_file(f) for f in stale}
+
+    parts = []
+    new_index = {}
+    start = 0
+    for f in files:
+        if f in parsed:
+            part = parsed[f]
+        else:
+            part = table[index[rel[f]]['start']:index[rel[f]]['stop']]
+        parts.append(part)
+        new_index[rel[f]] = {'stamp': _stamp(f), 'start': start, 'stop': start+len(part)}
+        start += len(part)
+    merged = np.concatenate(parts) if parts else np.zeros(0, dtype=AFC_DTYPE)
+    del parts, table # release the memory-mapped cache before it is replaced
+    if use_cache and (stale or set(index) != set(new_index)):
+        _write_cache(data_dir, new_index, merged)
+    return merged
+
+def summarize(trials, by=('condition',)):
+    '''
+    Trial counts, response proportions and mean RT for every combination of
+    the columns in by. Proportions are over all trials (no response counts as
+    an error); mean_rt is over responded trials only.
+    '''
+    keys = np.stack([trials[col].astype(np.int64) for col in by], axis=1)
+    groups, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    n_groups = len(groups)
+    n = np.bincount(inverse, minlength=n_groups)
+    summary = {col: groups[:, i] for i, col in enumerate(by)}
+    summary['n'] = n
+    for code, resp in enumerate(AFC_RESP):
+        summary[f'p_{resp}'] = np.bincount(inverse, weights=trials['afc_resp'] == code, minlength=n_groups) / n
+    responded = ~np.isnan(trials['resp_rt'])
+    n_rt = np.bincount(inverse, weights=responded, minlength=n_groups)
+    rt_sum = np.bincount(inverse, weights=np.where(responded, trials['resp_rt'], 0), minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        summary['mean_rt'] = rt_sum / n_rt
+    return summary
+
+# per-subject measures compared across conditions
+MEASURES = ['p_corr', 'p_lure', 'p_novel', 'p_none', 'lure_share', 'rt_corr', 'rt_lure', 'rt_novel']
+RT_QUANTILES = [.1, .25, .5, .75, .9]
+
+def group_quantiles(inverse, values, n_groups, q=.5):
+    # q-quantile (linear interpolation) of values within each group, ignoring NaNs; NaN for empty groups
+    ok = ~np.isnan(values)
+    inverse, values = inverse[ok], values[ok]
+    order = np.lexsort((values, inverse))
+    values = values[order]
+    n = np.bincount(inverse, minlength=n_groups)
+    start = np.concatenate(([0], np.cumsum(n)[:-1]))
+    pos = start + q*np.maximum(n-1, 0)
+    lo = np.floor(pos).astype(int)
+    hi = np.minimum(lo+1, start+np.maximum(n-1, 0))
+    out = np.full(n_groups, np.nan)
+    has = n > 0
+    w = pos[has] - lo[has]
+    out[has] = (1-w)*values[lo[has]] + w*values[hi[has]]
+    return out
+
+def subject_measures(trials):
+    '''
+    One entry per subject and condition: response rates over all trials,
+    lure_share = p_lure / (p_lure + p_novel) (how errors split between the
+    doppelganger's object and the novel object; NaN without errors) and the
+    median RT of correct, lure and novel responses.
+    '''
+    summary = summarize(trials, by=('sub', 'condition'))
+    keys = np.stack([trials['sub'].astype(np.int64), trials['condition'].astype(np.int64)], axis=1)
+    inverse = np.unique(keys, axis=0, return_inverse=True)[1].ravel()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        summary['lure_share'] = summary['p_lure'] / (summary['p_lure'] + summary['p_novel'])
+    for resp in ['corr', 'lure', 'novel']:
+        rt = np.where(trials['afc_resp'] == AFC_RESP.index(resp), trials['resp_rt'], np.nan)
+        summary[f'rt_{resp}'] = group_quantiles(inverse, rt, len(summary['n']))
+    return summary
+
+def rt_distribution(trials, quantiles=RT_QUANTILES):
+    # {(condition, response): RT quantiles over all responded trials}
+    out = {}
+    for c, condition in enumerate(CONDITIONS):
+        for r, resp in enumerate(AFC_RESP[1:], 1):
+            rt = trials['resp_rt'][(trials['condition'] == c) & (trials['afc_resp'] == r)]
+            out[condition, resp] = np.quantile(rt, quantiles) if len(rt) else np.full(len(quantiles), np.nan)
+    return out
+
+def bootstrap(values, n_boot=10000, ci=.95, seed=0):
+    '''
+    Mean over subjects and its percentile bootstrap CI for every column of
+    values (subjects x measures; NaNs ignored). All n_boot resamples are
+    drawn as one index array and averaged in one reduction.
+    '''
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+        values = values[:, None]
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, len(values), size=(n_boot, len(values)))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning) # all-NaN columns (e.g. no lure RTs)
+        means = np.nanmean(values[idx], axis=1) # (n_boot, measures)
+        lo, hi = np.nanpercentile(means, [(1-ci)/2*100, (1+ci)/2*100], axis=0)
+        return np.nanmean(values, axis=0), lo, hi
+
+def report(trials, n_boot=10000, ci=.95, seed=0):
+    '''
+    Rows of (measure, group, n subjects, mean, ci_lo, ci_hi) for each
+    condition and for the within-subject simultaneous - sequential contrast.
+    '''
+    subjects = subject_measures(trials)
+    table = np.stack([subjects[m] for m in MEASURES], axis=1)
+    rows = []
+    by_condition = {}
+    for c, condition in enumerate(CONDITIONS):
+        mask = subjects['condition'] == c
+        by_condition[c] = dict(zip(subjects['sub'][mask], table[mask]))
+        if mask.any():
+            mean, lo, hi = bootstrap(table[mask], n_boot, ci, seed)
+            rows += [(m, condition, int(mask.sum()), mean[i], lo[i], hi[i]) for i, m in enumerate(MEASURES)]
+    paired = sorted(set(by_condition[0]) & set(by_condition[1]))
+    if paired:
+        diff = np.array([by_condition[1][s] - by_condition[0][s] for s in paired])
+        mean, lo, hi = bootstrap(diff, n_boot, ci, seed)
+        rows += [(m, 'simultaneous-sequential', len(paired), mean[i], lo[i], hi[i]) for i, m in enumerate(MEASURES)]
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="3AFC confusion structure per condition with bootstrap CIs")
+    parser.add_argument('data_dir', nargs='?', default='data')
+    parser.add_argument('--boot', type=int, default=10000, help="bootstrap resamples")
+    parser.add_argument('--ci', type=float, default=.95)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--out', help="also save the table as a tsv")
+    args = parser.parse_args(argv)
+    trials = load_all(args.data_dir, workers=args.workers)
+    if not len(trials):
+        print(f"no 3AFC data under {args.data_dir}")
+        return 1
+    rows = report(trials, args.boot, args.ci, args.seed)
+    lines = ["measure\tgroup\tn_subjects\tmean\tci_lo\tci_hi"]
+    lines += [f"{m}\t{g}\t{n}\t{mean:.4f}\t{lo:.4f}\t{hi:.4f}" for m, g, n, mean, lo, hi in rows]
+    print(f"{len(trials)} trials from {len(np.unique(trials['sub']))} subjects, {args.boot} bootstrap resamples, {args.ci:.0%} CI")
+    print("\n".join(lines))
+    print("\nRT quantiles (s) " + " ".join(f"{q:g}" for q in RT_QUANTILES))
+    for (condition, resp), qs in rt_distribution(trials).items():
+        print(f"{condition}\t{resp}\t" + "\t".join(f"{q:.3f}" for q in qs))
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write("\n".join(lines)+"\n")
+
+if __name__ == '__main__':
+    sys.exit(main())
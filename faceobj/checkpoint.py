@@ -0,0 +1,75 @@
+'''
+Crash-resume checkpoints
+
+After every completed study or test trial the engine records how far into
+the schedule the session got in <filename>_checkpoint.json (a few hundred
+bytes, written to a temporary file and renamed into place, so a crash
+leaves either the old or the new checkpoint). All randomness of a session
+is drawn up front by compile_session() from sub_num, so the position in the
+schedule is the whole RNG state; the checkpoint stores a hash of the
+schedule to refuse resuming with different settings. The partial results
+are the lines already in <filename>_objafc.tsv, which the resumed session
+appends to. Onsets stay on one time line: the resumed session continues
+from the elapsed time of the last completed trial (the time lost to the
+crash is not counted).
+'''
+
+import os
+import json
+import hashlib
+
+def schedule_hash(schedule):
+    return hashlib.sha1(schedule.tobytes()).hexdigest()
+
+class Checkpoint:
+    def __init__(self, fname, schedule):
+        self.fname = fname
+        self.n_rows = len(schedule)
+        self.schedule = schedule_hash(schedule)
+        self.state = {'schedule': self.schedule, 'next_row': 0, 'elapsed': 0.0,
+                      'n_written': 0, 'resumes': 0, 'finished': False}
+
+    def load(self):
+        '''
+        Read the checkpoint of an earlier run of this session into state.
+        Returns False if there is none or it has already finished.
+        '''
+        if not os.path.exists(self.fname):
+            return False
+        with open(self.fname) as f:
+            state = json.load(f)
+        if state['schedule'] != self.schedule:
+            raise ValueError(f"{self.fname} was saved with a different schedule; "
+                             "resume with the same sub_num and task settings")
+        if state['finished']:
+            return False
+        self.state = state
+        self.state['resumes'] += 1
+        return True
+
+    def interrupted(self):
+        # whether fname holds an unfinished run of this schedule, i.e. load() would resume it
+        if not os.path.exists(self.fname):
+            return False
+        with open(self.fname) as f:
+            state = json.load(f)
+        return state['schedule'] == self.schedule and not state['finished']
+
+    @property
+    def next_row(self):
+        # schedule index of the first trial that hasn't been completed
+        return self.state['next_row']
+
+    def save(self, next_row, elapsed, n_written):
+        self.state.update(next_row=int(next_row), elapsed=float(elapsed), n_written=int(n_written))
+        self._write()
+
+    def finish(self):
+        self.state.update(next_row=self.n_rows, finished=True)
+        self._write()
+
+    def _write(self):
+        tmp = self.fname+'.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.fname)
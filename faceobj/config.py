@@ -0,0 +1,160 @@
+'''
+Session configuration
+
+SessionConfig holds every setting of a session. It is validated once when
+it is created and is immutable afterwards; the values the task derives from
+it (stimulus positions and sizes in Geometry, screen durations in whole
+frames via frame_counts()) are computed once and reused by the trial loop.
+
+The defaults are set in sequential.py/simultaneous.py and can be overridden
+by a JSON file and/or the command line, so a batch of subjects or
+conditions needs no code edits:
+
+python sequential.py --sub-num 12 --config pilot.json --iti 1000
+'''
+
+import sys
+import json
+import argparse
+import functools
+from dataclasses import dataclass, fields, asdict
+from faceobj.timing import to_frames
+from faceobj.schedule import NUM_IDENTITIES
+
+# timings used instead of the defaults when demo is set (unless given explicitly)
+DEMO_TIMING = dict(display_time=500, isi=50, iti=50, afc_time=1500)
+
+# text and fixation sizes
+fix_height = 119.46
+text_height = 50.7
+wrap_width = 1292
+radius_dim = .1
+
+@dataclass(frozen=True)
+class Geometry:
+    # positions and sizes in deg, precomputed from the display settings
+    center: tuple
+    afc_pos: tuple # left, middle, right 3AFC images (and the simultaneous study faces)
+    label_pos: tuple # 1/2/3 key labels under the 3AFC images
+    study_size: tuple
+    afc_size: tuple
+    label_height: float
+    fix_radius: float
+    text_height: float
+    wrap_width: float
+
+    @classmethod
+    def compute(cls, vis_deg, afc_vis_deg):
+        side, label_side, label_y = vis_deg/1.25, vis_deg/1.23, -vis_deg/2.4
+        return cls(center=(0, 0),
+                   afc_pos=((-side, 0), (0, 0), (side, 0)),
+                   label_pos=((-label_side, label_y), (0, label_y), (label_side, label_y)),
+                   study_size=(vis_deg, vis_deg), afc_size=(afc_vis_deg, afc_vis_deg),
+                   label_height=fix_height/100, fix_radius=radius_dim,
+                   text_height=text_height, wrap_width=wrap_width)
+
+@dataclass(frozen=True)
+class SessionConfig:
+    sub_num: str = '9999' # must be a positive number
+    demo: bool = False
+    fullscreen: bool = True
+    display_time: float = 2000 # ms
+    isi: float = 200
+    iti: float = 1200
+    afc_time: float = 2500
+    num_study_repetitions: int = 2
+    num_blocks: int = 2
+    num_study_stim: int = 6 # faces (identities x 2), up to 48
+    num_objects: int = 0 # size of the object pool the studied objects are drawn from (0: 2*num_study_stim, at most the objects on disk)
+    unique_foils: bool = False # draw each test block's novel foils without replacement
+    balanced: bool = False # each 3AFC location is correct equally often per block, instead of at random
+    # increasing doppelganger_distance means more dissimilar doppelganger (min=20 max=80)
+    doppelganger_distance: float = 60
+    morph_faces: bool = False
+    vis_deg: float = 10 # study image size
+    afc_vis_deg: float = 6 # 3AFC image size
+    buffered_log: bool = True
+    compose_screens: bool = True
+    profile: bool = False
+    resume: bool = False
+    stim_dir: str = None
+    data_dir: str = 'data'
+
+    def __post_init__(self):
+        # catch config typos before anything slow happens
+        object.__setattr__(self, 'sub_num', str(self.sub_num))
+        if not self.sub_num.isdigit() or int(self.sub_num) <= 0:
+            raise ValueError(f"sub_num must be a positive number, not {self.sub_num!r}")
+        for name in ['display_time', 'isi', 'iti', 'afc_time', 'vis_deg', 'afc_vis_deg']:
+            if not getattr(self, name) > 0:
+                raise ValueError(f"{name} must be positive, not {getattr(self, name)!r}")
+        if self.num_blocks < 1 or self.num_study_repetitions < 1:
+            raise ValueError("num_blocks and num_study_repetitions must be at least 1")
+        if self.num_study_stim < 4 or self.num_study_stim % 2:
+            raise ValueError(f"num_study_stim must be even and at least 4 (face/doppelganger pairs), not {self.num_study_stim}")
+        if self.num_study_stim//2 > NUM_IDENTITIES:
+            raise ValueError(f"num_study_stim must be at most {2*NUM_IDENTITIES} ({NUM_IDENTITIES} face identities), not {self.num_study_stim}")
+        if self.num_objects and self.num_objects < self.num_study_stim:
+            raise ValueError(f"num_objects must be 0 or at least num_study_stim, not {self.num_objects}")
+        if not 20 <= self.doppelganger_distance <= 80:
+            raise ValueError(f"doppelganger_distance must be between 20 and 80, not {self.doppelganger_distance}")
+
+    @functools.cached_property
+    def geometry(self):
+        return Geometry.compute(self.vis_deg, self.afc_vis_deg)
+
+    @property
+    def design(self):
+        # the settings compile_session() draws the schedule from
+        return dict(num_blocks=self.num_blocks, num_study_repetitions=self.num_study_repetitions,
+                    num_study_stim=self.num_study_stim, display_time=self.display_time,
+                    isi=self.isi, iti=self.iti, afc_time=self.afc_time,
+                    num_objects=self.num_objects or None, unique_foils=self.unique_foils,
+                    balanced=self.balanced)
+
+    def frame_counts(self, frame_dur):
+        # {ms: frames} of every timed screen, looked up by the frame timers instead of rounding per screen
+        return {float(ms): to_frames(ms, frame_dur)
+                for ms in (self.display_time, self.isi, self.iti, self.afc_time)}
+
+    def to_json(self, fname):
+        with open(fname, 'w') as f:
+            json.dump(asdict(self), f, indent=1)
+
+def _settings(fname):
+    with open(fname) as f:
+        settings = json.load(f)
+    unknown = set(settings) - set(f.name for f in fields(SessionConfig))
+    if unknown:
+        raise ValueError(f"unknown settings in {fname}: {', '.join(sorted(unknown))}")
+    return settings
+
+def _bool(text):
+    if text.lower() in ('1', 'true', 'yes'):
+        return True
+    if text.lower() in ('0', 'false', 'no'):
+        return False
+    raise argparse.ArgumentTypeError(f"expected true or false, not {text!r}")
+
+def parser():
+    # one --option per SessionConfig field, typed from its annotation
+    parser = argparse.ArgumentParser(description="Run a Face-Object 3AFC session")
+    parser.add_argument('--config', help="JSON file of settings (see SessionConfig)")
+    for field in fields(SessionConfig):
+        parser.add_argument('--'+field.name.replace('_', '-'), dest=field.name, default=None,
+                            type=_bool if field.type is bool else field.type, metavar=field.type.__name__.upper())
+    return parser
+
+def load(argv=None, **defaults):
+    '''
+    SessionConfig from defaults (e.g. a script's settings), overridden by
+    --config FILE and then by any other command-line option. With demo set,
+    DEMO_TIMING replaces the timings not given in the file or on the command line.
+    '''
+    args = vars(parser().parse_args(sys.argv[1:] if argv is None else argv))
+    explicit = _settings(args.pop('config')) if args.get('config') else {}
+    explicit.update((name, value) for name, value in args.items() if value is not None)
+    settings = dict(defaults, **explicit)
+    if settings.get('demo'):
+        settings.update((name, ms) for name, ms in DEMO_TIMING.items() if name not in explicit)
+    return SessionConfig(**settings)
@@ -0,0 +1,574 @@
+'''
+Task engine shared by sequential.py and simultaneous.py
+
+Everything except the study phase is identical between the two tasks:
+schedule compilation, stimulus checks and preloading, the window and
+stimulus objects, instructions, the 3AFC test and saving. TaskEngine does
+all of that once; the paradigm is a StudyPhase plugin (faceobj.study).
+Every screen goes through TaskEngine.show(), the single frame-locked loop.
+
+All settings come from a SessionConfig (faceobj.config), which also holds
+the precomputed geometry. With headless=True the engine runs on a virtual
+clock with null stimuli and no PsychoPy import (see faceobj.headless).
+'''
+
+import os
+import time
+import contextlib
+import numpy as np
+from faceobj.stimcache import StimulusCache, face_key, obj_key
+from faceobj.texpool import TexturePool
+from faceobj.manifest import StimulusManifest
+from faceobj.pack import FacePack, pack_path
+from faceobj.morph import MorphBasis, basis_path
+from faceobj.timing import FrameTimer
+from faceobj.results import TrialWriter, compact, truncate_trials, AFC_CODES
+from faceobj.schedule import compile_session, select_rows, STUDY, TEST
+from faceobj.checkpoint import Checkpoint
+from faceobj.profiler import Profiler
+
+# screens during which the buffered log is written to disk
+log_flush_labels = ('iti', 'instructions', 'finished')
+
+# screens during which the stimuli of the next trial are prepared (see prepare_next)
+prepare_labels = ('iti', 'instructions')
+
+# trigger = 'equal'
+ansKeys = ['1','2','3','4']
+
+class TaskEngine:
+    def __init__(self, study_phase, config, headless=False, observer=None, frame_dur=None):
+        # config is a validated SessionConfig (faceobj.config), read but never changed here
+        self.config = config
+        self.geometry = config.geometry
+        self.study_phase = study_phase
+        self.experiment_type = study_phase.name
+        self.sub_num = config.sub_num
+        self.demo = config.demo
+        self.num_blocks = config.num_blocks
+        # increasing doppelganger_distance means more dissimilar doppelganger (min=20 max=80)
+        self.doppelganger_distance = config.doppelganger_distance
+        self.headless = headless
+        self.observer = observer
+        self.frame_dur = frame_dur
+        # opt-in per-call timing of setImage/draw/flip/saving (faceobj.profiler)
+        self.profiler = Profiler(enabled=config.profile)
+        self.compose_screens = config.compose_screens
+        self.resuming = False
+        self.start_row = 0 # first schedule row to run (> 0 when resuming)
+        self._written_before = 0
+        self._upcoming = None
+        self.logFile = None
+        self.startup = {} # seconds per setup step, see startup_summary()
+
+        stim_dir = config.stim_dir or os.path.join(os.getcwd(), 'stimuli')
+        self.face_path = os.path.join(stim_dir, 'face_triangles', '')
+        self.obj_path = os.path.join(stim_dir, 'objects_seq_v_sim', 'object')
+        self.curSubj = f'sub-{self.sub_num}'
+        self.sub_dir = os.path.join(config.data_dir, self.curSubj)
+        self.filename = os.path.join(self.sub_dir, f'{self.curSubj}_{self.experiment_type}')
+
+        # every random choice of the session is drawn here, before the window opens
+        self.schedule = compile_session(self.sub_num, self.experiment_type, **self._design())
+        # progress saved after every trial so an interrupted session can be resumed (faceobj.checkpoint)
+        self.checkpoint = Checkpoint(f"{self.filename}_checkpoint.json", self.schedule)
+
+    def _design(self):
+        # config.design with the default object pool (2*num_study_stim) capped at the objects on disk
+        design = self.config.design
+        available = StimulusManifest.count_objects(self.obj_path)
+        if not available:
+            return design # no object folder (e.g. a headless run elsewhere); the manifest check reports it
+        folder = os.path.dirname(self.obj_path)
+        if self.config.num_study_stim > available:
+            raise ValueError(f"num_study_stim={self.config.num_study_stim} needs that many objects (num_objects), "
+                             f"but {folder} has {available}")
+        num_objects = design['num_objects'] or min(2*self.config.num_study_stim, available)
+        if num_objects > available:
+            raise ValueError(f"num_objects={num_objects}, but {folder} has {available} objects")
+        design['num_objects'] = num_objects
+        return design
+
+    ##############################################
+    ###                 SETUP                  ###
+    ##############################################
+
+    @contextlib.contextmanager
+    def _step(self, name):
+        start = time.perf_counter()
+        yield
+        self.startup[name] = time.perf_counter() - start
+
+    def startup_summary(self):
+        steps = ", ".join(f"{name} {s*1000:.0f}" for name, s in self.startup.items())
+        return f"{steps} (total {sum(self.startup.values())*1000:.0f} ms)"
+
+    def setup(self):
+        if self.headless:
+            from faceobj import headless
+            os.makedirs(self.sub_dir, exist_ok=True)
+            self._load_checkpoint()
+            self.win = None
+            visual = headless.NullVisual
+            self.frames = headless.VirtualFrameTimer(self.frame_dur or 1/60.)
+            self.preload()
+        else:
+            # cheapest checks first: output path, then stimulus files, and only then PsychoPy and the window
+            if self.demo:
+                print("\n\n\n--------WARNING! IN DEMO MODE--------\n\n\n")
+            print(f"filename: {self.filename}")
+            print(f"\n====SUBJECT {self.curSubj}====\n")
+            with self._step('output'):
+                self._load_checkpoint()
+                self._check_output()
+            with self._step('manifest'):
+                # resolve every stimulus file now so a missing one fails before the window opens;
+                # a resumed session only loads the stimuli of the trials it has left
+                remaining = self.schedule[self.start_row:]
+                objects = np.hstack((remaining['obj'], remaining['alt_obj'], remaining['rand_obj']))
+                self.stim_manifest = StimulusManifest.build(self.face_path, self.obj_path,
+                    faces=np.unique(np.abs(remaining['face'])), distances=[20,self.doppelganger_distance],
+                    objects=np.unique(objects[objects >= 0]), face_pack=self._face_source())
+            # decoding starts now, in the background of the PsychoPy import and the window opening
+            self.preload()
+            with self._step('import psychopy'):
+                # the heavy imports, here so they are timed rather than paid inside the first method using them
+                from psychopy import visual, core, logging
+                from psychopy.hardware import keyboard
+            with self._step('log'):
+                self._open_log()
+            with self._step('window'):
+                self.win = self._open_window(visual)
+                self.frames = FrameTimer(self.win, self.frame_dur) # frame-locked presentation + keyboard event queue
+                self.frames._quit = self._quit
+        self.frames.set_frame_counts(self.config.frame_counts(self.frames.frame_dur))
+        np.save(f"{self.filename}_schedule", self.schedule)
+        with self._step('stimuli'):
+            self._make_stimuli(visual)
+            self._instrument()
+        self.visual = visual
+        if not self.headless:
+            print(f"Startup (ms): {self.startup_summary()}")
+
+    def _face_source(self):
+        # generated morphs (python -m faceobj.morph), else the packed faces (python -m faceobj.pack) if built
+        if self.config.morph_faces:
+            basis = MorphBasis.open(basis_path(self.face_path))
+            if basis is None:
+                raise FileNotFoundError(f"{basis_path(self.face_path)} not found, build it with python -m faceobj.morph")
+            return basis
+        return FacePack.open(pack_path(self.face_path))
+
+    def _load_checkpoint(self):
+        # with resume=True, continue an interrupted session after its last completed trial
+        if not (self.config.resume and self.checkpoint.load()):
+            return
+        self.resuming = True
+        self.start_row = self.checkpoint.next_row
+        tsv = f"{self.filename}_objafc.tsv"
+        # drop a torn last line, or a trial written just before the crash but not checkpointed
+        n_written = truncate_trials(tsv, self.checkpoint.state['n_written']) if os.path.exists(tsv) else 0
+        tests = np.flatnonzero(self.schedule['phase'] == TEST)
+        if n_written < len(tests):
+            # trials that never reached the disk are run again
+            self.start_row = min(self.start_row, tests[n_written])
+        self._written_before = n_written
+        print(f"Resuming at schedule row {self.start_row}/{len(self.schedule)} "
+              f"(resume #{self.checkpoint.state['resumes']}, {n_written} 3AFC trials saved)")
+
+    def _completed(self, row):
+        # checkpoint after each trial (a few hundred bytes, written while its ITI is up)
+        self.checkpoint.save(row+1, self._now()-self.task_start, self._written_before+self.trial_writer.n)
+
+    def _check_output(self):
+        # refuse to overwrite a session, before PsychoPy is even imported
+        if os.path.exists(self.filename+'.log') and self.demo==False and not self.resuming:
+            print(f"{self.filename}.log already exists. Make sure you are not overwriting data!")
+            if self.checkpoint.interrupted():
+                print("To continue the interrupted session from its last completed trial, set resume = True.")
+            raise SystemExit(1)
+        os.makedirs(self.sub_dir, exist_ok=True)
+
+    def _open_log(self):
+        from psychopy import logging
+        # Save a log file for detail verbose info
+        filemode = 'a' if self.resuming else 'w'
+        if self.config.buffered_log:
+            # lines are queued in memory and written at ITIs/instructions (faceobj.logsink)
+            from faceobj.logsink import BufferedLogFile
+            self.logFile = BufferedLogFile(self.filename+'.log', level=logging.EXP, filemode=filemode)
+        else:
+            self.logFile = logging.LogFile(self.filename+'.log', level=logging.EXP, filemode=filemode)
+        logging.console.setLevel(logging.WARNING)  # this outputs to the screen, not a file
+        if self.resuming:
+            logging.exp(f"Resuming at schedule row {self.start_row}")
+
+    def _open_window(self, visual):
+        from psychopy import monitors
+        # https://pni-facilities.princeton.edu/index.php/2020_changes_to_MRI_screen_distances
+        mon = monitors.Monitor('testMonitor')
+        mon.setDistance(89) # distance to screen (cm) [Skyra=89] [Prisma=107.5]
+        win = visual.Window(
+            size=[1920,1080], fullscr=self.config.fullscreen, screen=0,
+            allowGUI=True, allowStencil=False,
+            monitor=mon, color=[0,0,0], colorSpace='rgb',
+            blendMode='avg', useFBO=True, units='pix')
+        win.mouseVisible = False
+
+        # Store frame rate of monitor if we can measure it
+        if self.frame_dur is None:
+            frameRate = win.getActualFrameRate()
+            if frameRate != None:
+                self.frame_dur = 1.0 / round(frameRate)
+            else:
+                self.frame_dur = 1.0 / 60.0  # could not measure, so guess
+        return win
+
+    def _make_stimuli(self, visual):
+        win = self.win
+        # one texture per unique stimulus, uploaded once at its native 256x256;
+        # the image "stims" below are slots that show one of them at a time
+        log_level = None
+        if not self.headless:
+            from psychopy import logging
+            log_level = logging.EXP # the slots log their image changes, as ImageStim would
+        self.textures = TexturePool(win, visual, lambda key: self.stim_cache.get(key), tex_res=256, log_level=log_level)
+        image = self.textures.slot
+        geometry = self.geometry
+        left, middle, right = geometry.afc_pos
+        def outline(pos):
+            return visual.Rect(
+                win=win, units='deg', size=geometry.afc_size,
+                ori=0, pos=pos, lineWidth=20,
+                colorSpace='rgb', lineColor=[-1,-1,-1],
+                fillColor=None, opacity=None,
+                depth=1, interpolate=False)
+        def label(text, pos, bold=False):
+            return visual.TextStim(win=win, units="deg",
+                text=text, font=u'Arial', bold=bold,
+                pos=pos, height=geometry.label_height, wrapWidth=None, ori=0,
+                color=u'black', colorSpace='rgb', opacity=1,
+                depth=0.0)
+        self.image_stim = image(geometry.center, geometry.study_size, 'image_stim')
+        self.image_left = image(left, geometry.afc_size, 'image_left')
+        self.image_middle = image(middle, geometry.afc_size, 'image_middle')
+        self.image_right = image(right, geometry.afc_size, 'image_right')
+        self.left_outline = outline(left)
+        self.middle_outline = outline(middle)
+        self.right_outline = outline(right)
+        self.fixColor = visual.Circle(win=win, units="deg",
+            radius=geometry.fix_radius,
+            fillColor=[-1, -1, -1],
+            lineColor=[-1, -1, -1])
+        # 3AFC key labels, rendered once in both weights; a response swaps
+        # which one is drawn instead of re-laying out the text via .bold
+        self.labels = [label(str(i+1), pos) for i,pos in enumerate(geometry.label_pos)]
+        self.bold_labels = [label(str(i+1), pos, bold=True) for i,pos in enumerate(geometry.label_pos)]
+
+    def _instrument(self):
+        profiler = self.profiler
+        if not profiler.enabled:
+            return
+        if self.win is not None:
+            profiler.instrument(self.win, 'flip')
+        for name in ['image_stim', 'image_left', 'image_middle', 'image_right']:
+            profiler.instrument(getattr(self, name), 'setImage')
+        for name in ['image_stim', 'image_left', 'image_middle', 'image_right', 'left_outline',
+                     'middle_outline', 'right_outline', 'fixColor']:
+            profiler.instrument(getattr(self, name), 'draw', f'draw:{name}')
+        for stim in self.labels+self.bold_labels:
+            profiler.instrument(stim, 'draw', 'draw:label')
+
+    def preload(self):
+        # decode every stimulus used this session once, so trials only swap in-memory images;
+        # the decoding runs in the background from setup until the first instructions are dismissed
+        if self.headless:
+            from faceobj.headless import NullCache
+            self.stim_cache = NullCache()
+            self.stim_ready = None
+            return
+        self.n_loaded = 0
+        def loading_progress(i,n):
+            self.n_loaded = i # called from the decoding threads
+        self.stim_cache = StimulusCache(self.stim_manifest.resolve, maxsize=len(self.stim_manifest))
+        self.stim_ready = self.stim_cache.prefetch(self.stim_manifest, progress=loading_progress)
+
+    def wait_for_stimuli(self):
+        # show the loading screen until the background decoding is done (re-raising its errors)
+        if self.stim_ready is None:
+            return
+        if not self.stim_ready.done():
+            waiting = self.visual.TextStim(self.win, pos=[0, 0], text="Loading images... (may take a minute)",
+                name="Waiting", height=self.geometry.text_height, wrapWidth=self.geometry.wrap_width)
+            while not self.stim_ready.done():
+                waiting.text = f"Loading images... ({self.n_loaded/len(self.stim_manifest)*100:.1f}%)"
+                waiting.draw()
+                self.win.flip()
+        self.stim_ready.result()
+        if len(self.textures) < len(self.stim_manifest):
+            # upload every texture before the first trial (GL calls stay on this thread)
+            self.textures.upload(self.stim_manifest)
+            print(f"Stimulus textures: {self.textures.summary()}")
+
+    ##############################################
+    ###       PRESENTATION                     ###
+    ##############################################
+
+    def show(self, stims, ms=None, label='', keys=None, on_key=None, prepare=None):
+        '''
+        Present stims for ms (or until one of keys). prepare() runs right
+        after the onset flip, while this screen is up; ITI and instruction
+        screens otherwise run whatever was queued with prepare_next().
+        '''
+        if label in log_flush_labels and hasattr(self.logFile, 'flush_async'):
+            self.logFile.flush_async()
+        if prepare is None and label in prepare_labels:
+            prepare, self._upcoming = self._upcoming, None
+        return self.frames.show(stims, ms, keys=keys, on_key=on_key, label=label, prepare=prepare)
+
+    def prepare_next(self, func):
+        # run func during the next ITI or instruction screen
+        self._upcoming = func
+
+    def compose(self, stims):
+        '''
+        Render stims (in drawing order) into an off-screen buffer now and
+        return a one-stimulus screen that shows them with a single blit.
+        Only the region the stims cover is read back, so this stays well
+        under a frame. Without a window, or with compose_screens=False,
+        stims are returned to be drawn one by one.
+        '''
+        if not self.compose_screens or self.win is None:
+            return list(stims)
+        with self.profiler.section('compose'):
+            rect, pos = self._capture_rect(stims)
+            # BufferImageStim clears the back buffer again after the capture
+            screen = self.visual.BufferImageStim(self.win, stim=stims, rect=rect, pos=pos, interpolate=False)
+        return [screen]
+
+    def _capture_rect(self, stims):
+        # bounding box of stims (pos/size in deg, lines in pix), snapped to whole
+        # pixels: BufferImageStim's rect in norm units and the pos (pix) that
+        # blits the capture back in place
+        from psychopy.tools.monitorunittools import deg2pix
+        width, height = self.win.size
+        boxes = []
+        for stim in stims:
+            (x, y), (w, h) = [deg2pix(np.asarray(v, dtype=float), self.win.monitor) for v in (stim.pos, stim.size)]
+            pad = (getattr(stim, 'lineWidth', 0) or 0)/2 + 1
+            boxes.append((x - abs(w)/2 - pad, y - abs(h)/2 - pad, x + abs(w)/2 + pad, y + abs(h)/2 + pad))
+        boxes = np.array(boxes)
+        left = max(0, int(np.floor(boxes[:, 0].min() + width/2)))
+        bottom = max(0, int(np.floor(boxes[:, 1].min() + height/2)))
+        right = min(width, int(np.ceil(boxes[:, 2].max() + width/2)))
+        top = min(height, int(np.ceil(boxes[:, 3].max() + height/2)))
+        # a quarter pixel in, so the window's int() of each edge lands on the intended pixel
+        norm = lambda px, size: 2*(px + .25)/size - 1
+        rect = [norm(left, width), norm(top, height), norm(right, width), norm(bottom, height)]
+        pos = ((left + right)/2 - width/2, (bottom + top)/2 - height/2)
+        return rect, pos
+
+    def face_image(self, face):
+        # stimulus key of the study image of face; negative ids are the doppelgangers
+        if face>0:
+            return face_key(face,20)
+        return face_key(face,self.doppelganger_distance)
+
+    def obj_image(self, obj):
+        return obj_key(obj)
+
+    def text_and_wait(self, text):
+        waiting = self.visual.TextStim(self.win, pos=[0, 0], text=text,
+            height=self.geometry.text_height, wrapWidth=self.geometry.wrap_width)
+        self.frames.trial = -1
+        self.show([waiting], keys=ansKeys, label='instructions')
+
+    def afc_wait(self, ms, corr_loc, images=None):
+        resp_rt = -999
+        afc_resp = 'none'
+        images = images or [self.image_left,self.image_middle,self.image_right]
+        screen = images+self.labels
+        def respond(key):
+            nonlocal afc_resp, resp_rt
+            loc = int(key.name)-1
+            afc_resp = AFC_CODES[corr_loc][loc]
+            resp_rt = key.rt
+            # the selected label is drawn bold from the next frame on
+            screen[-3:] = [self.bold_labels[i] if i==loc else self.labels[i] for i in range(3)]
+        if self.observer is not None: # headless: the synthetic observer presses during the 3AFC screen
+            response = self.observer.respond(corr_loc, self.frames.frames_for(ms)*self.frames.frame_dur)
+            if response is not None:
+                self.frames.press(*response)
+        self.show(screen, ms, keys=['1','2','3'], on_key=respond, label='afc')
+        return afc_resp, resp_rt
+
+    def obj_afc(self, rows):
+        resps = []
+        image_left, image_middle, image_right = self.image_left, self.image_middle, self.image_right
+        left_outline, right_outline = self.left_outline, self.right_outline
+        for row in rows:
+            t = self.schedule[row]
+            face, obj, alt_obj, rand_obj, corr_loc = t['face'], t['obj'], t['alt_obj'], t['rand_obj'], t['corr_loc']
+            self.frames.trial = t['trial']
+            # Study Face
+            self.image_stim.setImage(self.face_image(face))
+            self.show([self.image_stim], t['display_ms'], label='test_face')
+
+            # Select Object (3AFC), set up and composed while the ISI is up
+            afc_images = []
+            def prepare_afc():
+                if corr_loc==0: # correct on left
+                    image_left.setImage(self.obj_image(obj))
+                    image_middle.setImage(self.obj_image(rand_obj))
+                    image_right.setImage(self.obj_image(alt_obj))
+                elif corr_loc==1: # correct in middle
+                    image_left.setImage(self.obj_image(alt_obj))
+                    image_middle.setImage(self.obj_image(obj))
+                    image_right.setImage(self.obj_image(rand_obj))
+                elif corr_loc==2: # correct on right
+                    image_left.setImage(self.obj_image(rand_obj))
+                    image_middle.setImage(self.obj_image(alt_obj))
+                    image_right.setImage(self.obj_image(obj))
+                else:
+                    raise ValueError(f"corr_loc must be 0, 1 or 2, not {corr_loc}")
+                afc_images[:] = self.compose([image_left,image_middle,image_right])
+
+            # ISI
+            self.show([self.fixColor], t['isi_ms'], label='isi', prepare=prepare_afc)
+
+            afc_resp, resp_rt = self.afc_wait(t['afc_ms'],corr_loc,afc_images)
+            afc_onset = self.frames.onset - self.task_start
+            resps.append(afc_resp)
+
+            # ISI
+            self.show([self.fixColor], t['isi_ms'], label='isi')
+
+            # Feedback
+            feedback = [image_left,image_middle,image_right]
+            if corr_loc:
+                right_outline.lineColor=[0,1,0]
+                feedback.append(right_outline)
+                if not afc_resp:
+                    left_outline.lineColor=[1,0,0]
+                    feedback.append(left_outline)
+            else:
+                left_outline.lineColor=[0,1,0]
+                feedback.append(left_outline)
+                if not afc_resp:
+                    right_outline.lineColor=[1,0,0]
+                    feedback.append(right_outline)
+            self.show(feedback, t['display_ms'], label='feedback')
+            right_outline.lineColor=[-1,-1,-1]
+            left_outline.lineColor=[-1,-1,-1]
+
+            # ITI; the trial is final, so it is saved while the ITI is up rather than before the next onset
+            def save_trial():
+                self.trial_writer.write(sub=int(self.sub_num), condition=self.experiment_type, block=t['block'],
+                    repetition=t['repetition'], trial=t['trial'], face=face, obj=obj,
+                    alt_obj=alt_obj, rand_obj=rand_obj, corr_loc=corr_loc,
+                    afc_resp=afc_resp, resp_rt=resp_rt, onset=afc_onset)
+                self._completed(row)
+            self.show([self.fixColor], t['iti_ms'], label='iti', prepare=save_trial)
+        return resps
+
+    ##############################################
+    ###                   TASK                 ###
+    ##############################################
+
+    def run_trials(self):
+        # Start experiment (a resumed session skips the rows before start_row)
+        for block in range(self.num_blocks):
+            study = select_rows(self.schedule, STUDY, block)
+            study = study[study >= self.start_row]
+            if len(study):
+                # every study trial is prepared during the screen before it (instructions or the previous ITI)
+                self.study_phase.setup(self)
+                self.prepare_next(lambda: self.study_phase.prepare(self, self.schedule[study[0]]))
+                text=f'Study Task (Block {block+1}/{self.num_blocks})\n\n{self.study_phase.instructions}\n\nPress any key (1/2/3) to continue.'
+                self.text_and_wait(text)
+                self.wait_for_stimuli()
+                for i, row in enumerate(study):
+                    # the trial's last screen is its ITI, which checkpoints it and prepares the next one
+                    following = self.schedule[study[i+1]] if i+1 < len(study) else None
+                    def during_iti(row=row, following=following):
+                        self._completed(row)
+                        if following is not None:
+                            self.study_phase.prepare(self, following)
+                    self.prepare_next(during_iti)
+                    t = self.schedule[row]
+                    self.frames.trial = t['trial']
+                    self.study_phase.trial(self, t)
+                self.study_phase.teardown(self)
+            test = select_rows(self.schedule, TEST, block)
+            test = test[test >= self.start_row]
+            if len(test):
+                text=f'Memory Test (Block {block+1}/{self.num_blocks})\n\nYou will be shown a face, followed by three objects. Select the object associated with the face using your number keys.\n\nPress any key (1/2/3) to continue.'
+                self.text_and_wait(text)
+                self.wait_for_stimuli() # only waits when the session resumed in a test phase
+                obj_resps = self.obj_afc(test)
+                if not self.headless:
+                    print("obj_resps",obj_resps)
+
+    def run(self):
+        self.setup()
+        start_time = time.time()
+        # saved onsets are relative to this; a resumed session carries on from its last completed trial
+        self.task_start = self._now() - self.checkpoint.state['elapsed']
+        self.trial_writer = TrialWriter(f"{self.filename}_objafc.tsv", # one line per 3AFC trial, crash-safe
+            fsync_every=10**6 if self.headless else 4, append=self.resuming)
+        self.profiler.instrument(self.trial_writer, 'write', 'write_trial')
+        self.profiler.instrument(self.checkpoint, 'save', 'checkpoint')
+
+        try:
+            self.run_trials()
+        except Exception:
+            self.save_reports() # keep the frame timing of everything shown before the crash
+            raise
+
+        # compact the streamed trials into the final structured .npy
+        self.trial_writer.close()
+        with self.profiler.section('compact'):
+            trials = compact(self.trial_writer.fname, f"{self.filename}_objafc")
+        self.checkpoint.finish()
+
+        ##############################################
+        ###         Fixation to the end            ###
+        ##############################################
+        total_time = (time.time()-start_time)/60
+        if not self.headless:
+            print(f"\n===Finished! Total Time (min.): {total_time:.02f}===")
+        waiting = self.visual.TextStim(self.win, pos=[0, 0], text=\
+        f"Finished! Press any button to exit.",
+            name="Waiting",height=self.geometry.text_height, wrapWidth=self.geometry.wrap_width)
+        self.frames.trial = -1
+        # saved right after the onset of the last screen, which completes the timing of the one before
+        self.show([waiting], keys=ansKeys, label='finished', prepare=self.save_reports)
+        if not self.headless:
+            print(f"Timing error per screen type (actual - requested duration):\n{self.frames.summary()}")
+            print(f"Frame intervals per screen type:\n{self.frames.frame_summary()}")
+            if self.profiler.enabled:
+                print(f"Call durations:\n{self.profiler.summary()}")
+            from psychopy import core
+            core.quit()
+        return trials
+
+    def save_reports(self):
+        # _timing.tsv, _frames.tsv and _profile.tsv of everything shown so far;
+        # a resumed run saves its timing under its own name
+        run = f"_resume{self.checkpoint.state['resumes']}" if self.resuming else ''
+        self.frames.save(f"{self.filename}{run}_timing.tsv")
+        self.frames.save_frames(f"{self.filename}{run}_frames.tsv")
+        if self.profiler.enabled:
+            self.profiler.save(f"{self.filename}{run}_profile.tsv")
+
+    def _quit(self):
+        # escape key (see FrameTimer): save the timing reports before quitting
+        from psychopy import core
+        self.save_reports()
+        core.quit()
+
+    def _now(self):
+        if self.headless:
+            return self.frames.t # the virtual clock
+        from psychopy import core
+        return core.getTime() # same clock as win.flip
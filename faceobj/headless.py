@@ -0,0 +1,191 @@
+'''
+Headless dry runs with a synthetic observer
+
+Runs a full session through the task engine (faceobj.engine) without a
+window or PsychoPy: stimuli are null objects, screens advance a virtual
+clock by whole frames, the 3AFC responses come from a synthetic observer,
+and the session writes the same behavioral files as a real run
+(<filename>_schedule.npy, _objafc.tsv/.npy, _timing.tsv, _frames.tsv and
+_checkpoint.json). Useful for power analyses and for regression-testing the
+data pipeline on machines without a display.
+
+python -m faceobj.headless --task sequential --subs 1000 1999 --out sim_data
+
+With --check-resume every session is crashed halfway through its test
+trials (after the 3AFC line is written, before the checkpoint is saved),
+resumed with resume=True, and checked to end up with every 3AFC trial of
+the schedule exactly once, in order, on one time line.
+'''
+
+import sys
+import argparse
+import numpy as np
+from types import SimpleNamespace
+from faceobj.timing import FrameLog
+from faceobj.config import SessionConfig, DEMO_TIMING
+from faceobj.results import AFC_CODES, CONDITIONS
+from faceobj.schedule import TEST
+
+class Key:
+    # the parts of psychopy.hardware.keyboard.KeyPress the task uses
+    def __init__(self, name, rt, tDown):
+        self.name = name
+        self.rt = rt
+        self.tDown = tDown
+
+class NullStim:
+    # accepts any psychopy stimulus arguments and attributes; draws nothing
+    def __init__(self, win=None, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def draw(self, win=None):
+        pass
+
+    def setImage(self, image):
+        self.image = image
+
+NullVisual = SimpleNamespace(ImageStim=NullStim, Rect=NullStim, Circle=NullStim, TextStim=NullStim)
+
+class NullCache:
+    # StimulusCache stand-in that hands out the keys instead of decoded images
+    def get(self, key):
+        return key
+
+class SyntheticObserver:
+    '''
+    Picks the correct object, the doppelganger's object (lure) or the novel
+    object with the given probabilities (anything left over is no response)
+    and responds after a lognormal RT. Responses slower than the 3AFC window
+    are lost, as they would be in a real run.
+    '''
+    def __init__(self, p_corr=.6, p_lure=.25, p_novel=.1, rt_median=1.1, rt_sigma=.35, seed=None):
+        self.p = np.array([p_corr, p_lure, p_novel])
+        if self.p.sum() > 1:
+            raise ValueError("p_corr + p_lure + p_novel must be at most 1")
+        self.rt_median = rt_median
+        self.rt_sigma = rt_sigma
+        self.rng = np.random.default_rng(seed)
+
+    def respond(self, corr_loc, window_s):
+        # (key name, rt) or None
+        u = self.rng.random()
+        choice = int(np.searchsorted(np.cumsum(self.p), u, side='right'))
+        rt = self.rng.lognormal(np.log(self.rt_median), self.rt_sigma)
+        if choice == 3 or rt >= window_s:
+            return None
+        loc = AFC_CODES[corr_loc].index(['corr','lure','novel'][choice])
+        return str(loc+1), rt
+
+class VirtualFrameTimer(FrameLog):
+    '''
+    FrameTimer stand-in on a virtual clock: every screen lasts exactly its
+    whole number of frames and key presses come from press().
+    '''
+    def __init__(self, frame_dur):
+        super().__init__(frame_dur)
+        self.t = 0.0
+        self._presses = []
+
+    def press(self, name, rt):
+        # deliver a key press rt seconds after the onset of the next screen
+        self._presses.append((name, rt))
+
+    def show(self, stims, ms=None, keys=None, on_key=None, label='', prepare=None):
+        if ms is None:
+            n_frames = 1 # instructions: the virtual participant presses a key at once
+            target_s = np.nan
+            if keys and not self._presses:
+                self._presses.append((keys[0], self.frame_dur/2))
+        else:
+            n_frames = self.frames_for(ms)
+            target_s = n_frames * self.frame_dur
+        self._onset(label, target_s, self.t)
+        self._flip(self.t + np.arange(n_frames)*self.frame_dur)
+        if prepare is not None:
+            prepare()
+        duration = n_frames * self.frame_dur
+        pressed = [Key(name, rt, self.t+rt) for name, rt in self._presses
+                   if keys and name in keys and rt < duration]
+        self._presses = []
+        if on_key is not None:
+            for key in pressed:
+                on_key(key)
+        self.t += duration
+        return pressed
+
+def _engine(sub_num, experiment_type, out_dir, observer, frame_dur, **design):
+    from faceobj.engine import TaskEngine
+    from faceobj.study import STUDY_PHASES
+    config = SessionConfig(sub_num=sub_num, data_dir=out_dir, **design)
+    observer = observer or SyntheticObserver(seed=int(sub_num))
+    return TaskEngine(STUDY_PHASES[experiment_type](), config,
+        headless=True, observer=observer, frame_dur=frame_dur)
+
+def run_session(sub_num, experiment_type, out_dir='sim_data', observer=None,
+                frame_dur=1/60., **design):
+    '''
+    Simulate one session and write its files under
+    out_dir/sub-#/sub-#_<experiment_type>. Returns the compacted 3AFC trials.
+    '''
+    return _engine(sub_num, experiment_type, out_dir, observer, frame_dur, **design).run()
+
+class SimulatedCrash(Exception):
+    pass
+
+def check_resume(sub_num, experiment_type, out_dir='sim_data', observer=None,
+                 frame_dur=1/60., crash_row=None, **design):
+    '''
+    Simulate a session that crashes at schedule row crash_row (default: the
+    middle test trial, after its 3AFC line is written but before it is
+    checkpointed), resume it, and check the resumed session's trials against
+    the schedule. Raises RuntimeError if they don't match. Returns the trials.
+    '''
+    engine = _engine(sub_num, experiment_type, out_dir, observer, frame_dur, **design)
+    tests = np.flatnonzero(engine.schedule['phase'] == TEST)
+    if crash_row is None:
+        crash_row = tests[len(tests)//2]
+    completed = engine._completed
+    def crash(row):
+        if row == crash_row:
+            raise SimulatedCrash(f"simulated crash at schedule row {row}")
+        completed(row)
+    engine._completed = crash
+    try:
+        engine.run()
+        raise RuntimeError(f"schedule row {crash_row} was never reached")
+    except SimulatedCrash:
+        pass
+    resumed = _engine(sub_num, experiment_type, out_dir, observer, frame_dur, resume=True, **design)
+    trials = resumed.run()
+    expected = resumed.schedule[tests]
+    for name in ['block', 'repetition', 'trial', 'face', 'obj', 'alt_obj', 'rand_obj', 'corr_loc']:
+        if len(trials) != len(expected) or not np.array_equal(trials[name], expected[name]):
+            raise RuntimeError(f"{resumed.filename}: resumed 3AFC trials differ from the schedule in {name}")
+    if not np.all(np.diff(trials['onset']) > 0):
+        raise RuntimeError(f"{resumed.filename}: 3AFC onsets of the resumed session are not increasing")
+    return trials
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate Face-Object 3AFC sessions without a display")
+    parser.add_argument('--task', choices=CONDITIONS+['both'], default='both')
+    parser.add_argument('--subs', type=int, nargs=2, default=[1000, 1009], metavar=('FIRST', 'LAST'))
+    parser.add_argument('--out', default='sim_data')
+    parser.add_argument('--p-corr', type=float, default=.6)
+    parser.add_argument('--p-lure', type=float, default=.25)
+    parser.add_argument('--p-novel', type=float, default=.1)
+    parser.add_argument('--rt-median', type=float, default=1.1)
+    parser.add_argument('--demo', action='store_true', help="use the scripts' demo timings")
+    parser.add_argument('--check-resume', action='store_true', help="crash every session halfway and check that it resumes")
+    args = parser.parse_args(argv)
+    design = DEMO_TIMING if args.demo else {}
+    tasks = CONDITIONS if args.task == 'both' else [args.task]
+    for sub_num in range(args.subs[0], args.subs[1]+1):
+        for task in tasks:
+            observer = SyntheticObserver(args.p_corr, args.p_lure, args.p_novel,
+                rt_median=args.rt_median, seed=sub_num*len(CONDITIONS)+CONDITIONS.index(task))
+            simulate = check_resume if args.check_resume else run_session
+            simulate(sub_num, task, args.out, observer, **design)
+    print(f"simulated subjects {args.subs[0]}-{args.subs[1]} ({', '.join(tasks)}) into {args.out}/")
+
+if __name__ == '__main__':
+    sys.exit(main())
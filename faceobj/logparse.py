@@ -0,0 +1,128 @@
+'''
+PsychoPy .log parser
+
+Streams a sub-#_{sequential,simultaneous}.log into a typed event table
+(time, level, object, attribute, value), one record per log entry with
+continuation lines folded into the entry they belong to. The file is read
+line by line and emitted in fixed-size chunks, so memory stays bounded for
+full-session logs, and several logs are parsed in parallel with one worker
+process per file.
+
+from faceobj.logparse import parse_log
+log = parse_log('data/sub-999/sub-999_sequential.log')
+log['keypresses']['time'], log['keypresses']['key']
+log['images']['time'], log['images']['image']
+log['onsets']['time'], log['onsets']['screen'] # logged by faceobj.timing.FrameTimer
+
+In logs written by the task engine the keypresses are logged by FrameTimer
+and the image changes by the pooled image slots (faceobj.texpool); an image
+prepared during the previous screen is logged at that screen's next flip,
+so use the onsets for when it was shown.
+'''
+
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+LEVELS = ['CRITICAL', 'ERROR', 'WARNING', 'DATA', 'EXP', 'INFO', 'DEBUG']
+
+# strings are stored as truncated utf-8 bytes to keep records fixed-width
+LOG_DTYPE = np.dtype([('time', 'f8'), ('level', 'i1'), ('object', 'S48'),
+                      ('attribute', 'S32'), ('value', 'S256')])
+KEY_DTYPE = np.dtype([('time', 'f8'), ('key', 'S16')])
+IMAGE_DTYPE = np.dtype([('time', 'f8'), ('object', 'S48'), ('image', 'S256')])
+ONSET_DTYPE = np.dtype([('time', 'f8'), ('screen', 'S32')])
+
+def split_message(message):
+    # (object, attribute, value) of one log message
+    if message.startswith('Keypress: '):
+        return 'keyboard', 'keypress', message[10:]
+    if message.startswith('Created '):
+        obj, _, value = message[8:].partition(' = ')
+        return obj, 'created', value
+    obj, sep, rest = message.partition(': ')
+    if not sep:
+        return '', '', message
+    attribute, sep, value = rest.partition(' = ')
+    if not sep:
+        return obj, '', rest
+    return obj, attribute, value
+
+def iter_entries(fname):
+    # (time, level, message) per entry; lines that don't start with a timestamp continue the previous entry
+    entry = None
+    with open(fname, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            t, sep, rest = line.partition('\t')
+            try:
+                t = float(t) if sep else None
+            except ValueError:
+                t = None
+            if t is None:
+                if entry is not None:
+                    entry[2] += '\n'+line
+                continue
+            if entry is not None:
+                yield entry
+            level, _, message = rest.partition('\t')
+            entry = [t, level.strip(), message]
+    if entry is not None:
+        yield entry
+
+def iter_events(fname, chunk_size=65536):
+    # LOG_DTYPE arrays of at most chunk_size events
+    chunk = np.zeros(chunk_size, dtype=LOG_DTYPE)
+    i = 0
+    for t, level, message in iter_entries(fname):
+        obj, attribute, value = split_message(message)
+        chunk[i] = (t, LEVELS.index(level) if level in LEVELS else -1,
+                    obj.encode()[:48], attribute.encode()[:32], value.encode()[:256])
+        i += 1
+        if i == chunk_size:
+            yield chunk
+            chunk = np.zeros(chunk_size, dtype=LOG_DTYPE)
+            i = 0
+    if i:
+        yield chunk[:i]
+
+def parse_log(fname, chunk_size=65536, keep_events=True):
+    '''
+    dict with 'events' (LOG_DTYPE), 'keypresses' (KEY_DTYPE), 'images'
+    (IMAGE_DTYPE, the flip time at which an ImageStim's image changed) and
+    'onsets' (ONSET_DTYPE, the onset flip of every FrameTimer screen). With
+    keep_events=False only the indexes are kept in memory.
+    '''
+    events, keys, images, onsets = [], [], [], []
+    for chunk in iter_events(fname, chunk_size):
+        is_key = chunk['attribute'] == b'keypress'
+        is_image = chunk['attribute'] == b'image'
+        is_onset = (chunk['object'] == b'screen') & (chunk['attribute'] == b'onset')
+        key_part = np.zeros(is_key.sum(), dtype=KEY_DTYPE)
+        key_part['time'] = chunk['time'][is_key]
+        key_part['key'] = chunk['value'][is_key]
+        image_part = np.zeros(is_image.sum(), dtype=IMAGE_DTYPE)
+        image_part['time'] = chunk['time'][is_image]
+        image_part['object'] = chunk['object'][is_image]
+        image_part['image'] = np.char.strip(chunk['value'][is_image], b"'")
+        onset_part = np.zeros(is_onset.sum(), dtype=ONSET_DTYPE)
+        onset_part['time'] = chunk['time'][is_onset]
+        onset_part['screen'] = chunk['value'][is_onset]
+        keys.append(key_part)
+        images.append(image_part)
+        onsets.append(onset_part)
+        if keep_events:
+            events.append(chunk)
+    def merge(parts, dtype):
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+    return {'events': merge(events, LOG_DTYPE), 'keypresses': merge(keys, KEY_DTYPE),
+            'images': merge(images, IMAGE_DTYPE), 'onsets': merge(onsets, ONSET_DTYPE)}
+
+def _parse_indexes(fname):
+    return parse_log(fname, keep_events=False)
+
+def parse_logs(fnames, workers=None, keep_events=False):
+    # {fname: parse_log(fname)} with one worker process per file
+    fnames = list(fnames)
+    func = parse_log if keep_events else _parse_indexes
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(fnames, pool.map(func, fnames)))
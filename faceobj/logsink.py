@@ -0,0 +1,102 @@
+'''
+Buffered PsychoPy log file
+
+PsychoPy only hands log entries to its targets in psychopy.logging.flush(),
+which win.flip() does not call, so without explicit flushes a session's
+whole log is written in one burst at exit; psychopy.logging.LogFile writes
+(and flushes) every line on the thread that calls it. BufferedLogFile is a
+drop-in logging target: flush_async() (called by the task engine at ITIs,
+instructions and the end of the session) runs logging.flush(), which for
+this target only appends the formatted lines to an in-memory list, and
+wakes a background thread that writes them to disk. Entry timestamps are
+taken when the entry is logged, so the file content is the same as with
+LogFile apart from the dropped attributes. close() flushes the logger
+first, so the log is complete on exit or after a crash.
+'''
+
+import atexit
+import threading
+
+# attribute changes that carry no experimental information in these tasks
+DEFAULT_DROP = ('height', 'font', 'wrapWidth')
+
+class _NoFlush:
+    # what psychopy.logging sees as the target's stream: its flush() runs on
+    # the main thread and must not touch the file the writer thread uses
+    def flush(self):
+        pass
+
+class BufferedLogFile:
+    def __init__(self, fname, level, filemode='w', drop_attributes=DEFAULT_DROP,
+                 max_lines=20000, encoding='utf8'):
+        from psychopy import logging
+        self.level = level
+        self.drop = set(drop_attributes)
+        self.max_lines = max_lines
+        self._file = open(fname, filemode, encoding=encoding)
+        self.stream = _NoFlush()
+        self._lines = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='log-sink', daemon=True)
+        self._thread.start()
+        self.logger = logging.root
+        self._flush_logger = logging.flush
+        self.logger.addTarget(self)
+        atexit.register(self.close)
+
+    def setLevel(self, level):
+        self.level = level
+        self.logger._calcLowestTarget()
+
+    def write(self, txt):
+        # called by psychopy.logging.flush() from the flipping thread: no I/O here
+        with self._lock:
+            self._lines.append(txt)
+            n = len(self._lines)
+        if n > self.max_lines:
+            self._wake.set()
+
+    def flush_async(self):
+        # hand the pending entries to the targets (formatting only, no I/O for this one),
+        # then write everything buffered so far on the background thread
+        self._flush_logger()
+        self._wake.set()
+
+    def _keep(self, line):
+        # lines look like "<time> \t<LEVEL> \t<object>: <attribute> = <value>"
+        if '\t' not in line:
+            return True # continuation of a multi-line entry
+        message = line.rsplit('\t', 1)[-1]
+        obj, sep, rest = message.partition(': ')
+        return not sep or rest.partition(' = ')[0] not in self.drop
+
+    def _write_buffer(self):
+        with self._lock:
+            chunks, self._lines = self._lines, []
+        if chunks:
+            text = ''.join(chunks)
+            if self.drop:
+                text = ''.join(line for line in text.splitlines(True) if self._keep(line))
+            self._file.write(text)
+            self._file.flush()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait()
+            self._wake.clear()
+            self._write_buffer()
+
+    def close(self):
+        if self._closed:
+            return
+        # entries logged since the last flush_async(), e.g. on an unhandled exception;
+        # this runs before PsychoPy's own atexit flush, which would no longer reach this target
+        self._flush_logger()
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        self._write_buffer()
+        self.logger.removeTarget(self)
+        self._file.close()
@@ -0,0 +1,94 @@
+'''
+Stimulus manifest
+
+Resolves every logical stimulus of a session (face id + morph distance,
+object id) to a verified file once at startup. Lookups during trials are a
+dict access with no filesystem probing, and a missing file raises before the
+session starts instead of mid-block. With a face_pack (a FacePack from
+faceobj.pack, or a MorphBasis from faceobj.morph) the faces it contains
+resolve to image arrays instead of files.
+'''
+
+import os
+from faceobj.stimcache import face_key, obj_key
+
+class StimulusManifest:
+    exts = ('.jpg', '.png') # first existing extension wins
+
+    def __init__(self, face_path, obj_path, face_pack=None):
+        # obj_path is a filename prefix (e.g. .../objects_seq_v_sim/object)
+        self.face_path = face_path
+        self.obj_path = obj_path
+        self.face_pack = face_pack
+        self.missing = []
+        self._paths = {}
+        self._listings = {}
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __iter__(self):
+        return iter(self._paths)
+
+    def __contains__(self, key):
+        return key in self._paths
+
+    def _find(self, stem):
+        # one directory listing per folder instead of an os.path.exists per candidate
+        folder, prefix = os.path.split(stem)
+        if folder not in self._listings:
+            self._listings[folder] = set(os.listdir(folder)) if os.path.isdir(folder) else set()
+        for ext in self.exts:
+            if prefix+ext in self._listings[folder]:
+                return stem+ext
+        return None
+
+    def _add(self, key, stem):
+        if key in self._paths:
+            return
+        path = self._find(stem)
+        if path is None:
+            self.missing.append(stem+self.exts[0])
+        else:
+            self._paths[key] = path
+
+    def add_face(self, face, distance):
+        key = face_key(face, distance)
+        if self.face_pack is not None and key in self.face_pack:
+            self._paths[key] = self.face_pack[key]
+            return
+        self._add(key, self.face_path+f'{key[1]}_{key[2]}')
+
+    def add_obj(self, obj):
+        key = obj_key(obj)
+        self._add(key, self.obj_path+str(key[1]))
+
+    def verify(self):
+        if self.missing:
+            raise FileNotFoundError(f"{len(self.missing)} stimulus file(s) missing: "+", ".join(self.missing))
+
+    def resolve(self, key):
+        # file path, or (H, W, 3) uint8 array for packed faces
+        return self._paths[key]
+
+    __getitem__ = resolve
+
+    @classmethod
+    def build(cls, face_path, obj_path, faces, distances, objects, face_pack=None):
+        manifest = cls(face_path, obj_path, face_pack)
+        for face in faces:
+            for distance in distances:
+                manifest.add_face(face, distance)
+        for obj in objects:
+            manifest.add_obj(obj)
+        manifest.verify()
+        return manifest
+
+    @classmethod
+    def count_objects(cls, obj_path):
+        # number of consecutive object files obj_path0, obj_path1, ... (0 if there are none)
+        manifest = cls(None, obj_path)
+        n = 0
+        while manifest._find(obj_path+str(n)) is not None:
+            n += 1
+        return n
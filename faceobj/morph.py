@@ -0,0 +1,158 @@
+'''
+Morph engine
+
+Every identity in stimuli/face_triangles/ has 120 morph steps
+(<identity>_<morph>.jpg). build_basis() reduces each identity's steps to a
+low-rank PCA basis (mean image + rank components + one coefficient vector
+per step) saved as stimuli/face_triangles_basis.npz. The components are
+stored as int8 with a scale per component and the file is compressed
+(about 28 MB at rank 16, vs. 32 MB of JPEGs). MorphBasis reconstructs any
+morph level from it, including levels between the stored steps (the
+coefficients are interpolated linearly), so doppelganger_distance can be
+swept continuously or adapted per subject without the JPEGs. A
+reconstruction is one (1 x rank+1) @ (rank+1 x pixels) product in float32
+with the mean folded in as the first row, results are cached, and
+morphs() reconstructs many faces at once with one product per identity,
+so faces that share an identity share the pass over its components.
+
+At rank 16 the reconstructions are ~36 dB PSNR from the original JPEGs
+on average (~30 dB worst case); the int8 components cost ~0.3 dB of
+that. build_basis() prints the worst case.
+
+python -m faceobj.morph stimuli/face_triangles --rank 16
+'''
+
+import os
+import sys
+import argparse
+import functools
+import numpy as np
+from PIL import Image
+from faceobj.pack import _scan
+
+def basis_path(face_path):
+    # stimuli/face_triangles/ -> stimuli/face_triangles_basis.npz
+    return os.path.normpath(face_path)+'_basis.npz'
+
+def build_basis(face_path, out=None, rank=16, step=2.0):
+    '''
+    Fit a PCA basis per identity to the morph steps in face_path and save it
+    to out (default basis_path()). Returns the MorphBasis.
+    '''
+    out = out or basis_path(face_path)
+    files = _scan(face_path)
+    identities = sorted(set(i for i, _ in files))
+    levels = sorted(set(m for _, m in files))
+    means, components, scales, coeffs, worst = [], [], [], [], np.inf
+    for identity in identities:
+        X = np.stack([np.asarray(Image.open(os.path.join(face_path, files[identity, m])).convert('RGB'),
+                                 dtype=np.float32) for m in levels])
+        shape = X.shape[1:]
+        X = X.reshape(len(levels), -1)
+        mean = X.mean(0)
+        X -= mean
+        # PCA via the (levels x levels) Gram matrix, much cheaper than an SVD of X with 196608 pixels
+        eigvals, U = np.linalg.eigh(X @ X.T)
+        U = U[:, ::-1][:, :rank]
+        S = np.sqrt(np.maximum(eigvals[::-1][:rank], 1e-12))
+        Vt = (U.T @ X) / S[:, None]
+        # int8 components, quantized so that each is off by at most step/2 grey
+        # levels at its largest coefficient (finer if it would overflow int8)
+        scale = np.maximum(step/np.abs(U*S).max(0), np.abs(Vt).max(1)/127)
+        Vq = np.round(Vt / scale[:, None]).astype(np.int8)
+        means.append(mean.astype(np.float16))
+        components.append(Vq)
+        scales.append(scale.astype(np.float32))
+        coeffs.append((U*S).astype(np.float32))
+        err = np.sqrt(((((U*S)*scale) @ Vq + mean.astype(np.float16) - (X + mean))**2).mean(1))
+        worst = min(worst, (20*np.log10(255/np.maximum(err, 1e-6))).min())
+    tmp = out+'.tmp.npz'
+    np.savez_compressed(tmp, identities=identities, levels=levels, shape=shape, means=np.stack(means),
+                        components=np.stack(components), scales=np.stack(scales), coeffs=np.stack(coeffs))
+    os.replace(tmp, out)
+    print(f"{len(identities)} identities x {len(levels)} levels at rank {rank}: worst reconstruction {worst:.1f} dB PSNR")
+    return MorphBasis(out)
+
+class MorphBasis:
+    def __init__(self, fname, cache_size=256):
+        self.fname = fname
+        with np.load(fname) as f:
+            self.identities = {int(identity): i for i, identity in enumerate(f['identities'])}
+            self.levels = f['levels'].astype(np.float32)
+            self.shape = tuple(f['shape'])
+            self.means = f['means'] # float16 means and int8 components, converted per identity on first use
+            self.components = f['components']
+            # bases saved before the int8 components have float16 ones and no scales
+            self.scales = f['scales'] if 'scales' in f.files else np.ones(self.components.shape[:2], np.float32)
+            self.coeffs = f['coeffs']
+        self.morph = functools.lru_cache(maxsize=cache_size)(self._morph)
+        self._basis = functools.lru_cache(maxsize=None)(self._float_basis)
+
+    @classmethod
+    def open(cls, fname):
+        # the basis at fname, or None if it hasn't been built
+        return cls(fname) if os.path.exists(fname) else None
+
+    def _float_basis(self, i):
+        # (rank+1, pixels) float32: the mean (+.5 to round on the uint8 cast), then the scaled components
+        basis = np.empty((len(self.scales[i])+1, self.means.shape[1]), dtype=np.float32)
+        basis[0] = self.means[i]
+        basis[0] += .5
+        np.multiply(self.components[i], self.scales[i][:, None], out=basis[1:])
+        return basis
+
+    def _coeffs(self, i, levels):
+        # (n, rank) coefficients of identities i at levels, interpolated between the stored steps
+        levels = np.clip(np.asarray(levels, dtype=np.float32), self.levels[0], self.levels[-1])
+        hi = np.clip(np.searchsorted(self.levels, levels), 1, len(self.levels)-1)
+        lo = hi - 1
+        w = ((levels - self.levels[lo]) / (self.levels[hi] - self.levels[lo]))[:, None]
+        return (1-w)*self.coeffs[i, lo] + w*self.coeffs[i, hi]
+
+    def morphs(self, identities, levels):
+        # (n, H, W, 3) uint8 faces of identities at morph levels, in one batch
+        i = np.array([self.identities[abs(int(identity))] for identity in identities])
+        order = np.argsort(i, kind='stable')
+        i = i[order]
+        # a leading 1 picks up the mean row of the basis
+        c = np.ones((len(i), self.coeffs.shape[2]+1), dtype=np.float32)
+        c[:, 1:] = self._coeffs(i, np.broadcast_to(levels, order.shape)[order])
+        faces = np.empty((len(i), self.means.shape[1]), dtype=np.float32)
+        # one product per identity, straight into its run of rows (sorted by identity)
+        starts = list(np.flatnonzero(np.diff(i, prepend=-1))) + [len(i)]
+        for start, stop in zip(starts[:-1], starts[1:]):
+            basis = self._basis(i[start])
+            if stop - start < 4:
+                # a product per face: BLAS is slower per row at 2-3 rows than at one
+                for row in range(start, stop):
+                    np.matmul(c[row:row+1], basis, out=faces[row:row+1])
+            else:
+                np.matmul(c[start:stop], basis, out=faces[start:stop])
+        np.clip(faces, 0, 255, out=faces)
+        images = np.empty(faces.shape, dtype=np.uint8)
+        images[order] = faces # back in the requested order, cast on the way
+        return images.reshape((len(i),)+self.shape)
+
+    def _morph(self, identity, level):
+        # one face; identity is abs(face id). Cached, so treat the result as read-only
+        return self.morphs([identity], [level])[0]
+
+    def __contains__(self, key):
+        # face_key()s of identities in the basis at levels within the stored range
+        return (key[0] == 'face' and key[1] in self.identities
+                and self.levels[0] <= key[2] <= self.levels[-1])
+
+    def __getitem__(self, key):
+        return self.morph(key[1], float(key[2]))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fit the per-identity morph basis")
+    parser.add_argument('face_path', nargs='?', default=os.path.join('stimuli', 'face_triangles'))
+    parser.add_argument('--rank', type=int, default=16)
+    parser.add_argument('--step', type=float, default=2.0, help="component quantization step (grey levels)")
+    args = parser.parse_args(argv)
+    basis = build_basis(args.face_path, rank=args.rank, step=args.step)
+    print(f"-> {basis.fname}")
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+'''
+Packed face stimuli
+
+stimuli/face_triangles/ holds one 256x256 JPEG per identity and morph step
+(<identity>_<morph>.jpg). build_pack() decodes them once into a single
+uint8 array of shape (identity, morph, H, W, 3) saved as
+stimuli/face_triangles.npy, with the identity and morph ids it covers in
+face_triangles.json. FacePack memory-maps it, so a face is an array slice:
+no file is opened or JPEG decoded per stimulus and only the pages of the
+faces a session uses are read. When the pack exists the task picks it up
+automatically (see StimulusManifest).
+
+python -m faceobj.pack stimuli/face_triangles
+'''
+
+import os
+import sys
+import json
+import numpy as np
+from PIL import Image
+
+def pack_path(face_path):
+    # stimuli/face_triangles/ -> stimuli/face_triangles.npy
+    return os.path.normpath(face_path)+'.npy'
+
+def _index_path(fname):
+    return os.path.splitext(fname)[0]+'.json'
+
+def _scan(face_path):
+    # {(identity, morph): filename} of every <identity>_<morph>.<ext> in face_path
+    files = {}
+    for name in os.listdir(face_path):
+        stem, ext = os.path.splitext(name)
+        identity, sep, morph = stem.partition('_')
+        if ext.lower() in ('.jpg', '.png') and sep and identity.isdigit() and morph.isdigit():
+            files.setdefault((int(identity), int(morph)), name)
+    return files
+
+def build_pack(face_path, out=None, progress=None):
+    '''
+    Decode every face image in face_path into out (default pack_path()).
+    Missing identity/morph combinations are left black and not indexed.
+    Returns the FacePack.
+    '''
+    out = out or pack_path(face_path)
+    files = _scan(face_path)
+    if not files:
+        raise FileNotFoundError(f"no <identity>_<morph> images in {face_path}")
+    identities = sorted(set(i for i, _ in files))
+    morphs = sorted(set(m for _, m in files))
+    with Image.open(os.path.join(face_path, next(iter(files.values())))) as im:
+        width, height = im.size
+    tmp = out+'.tmp.npy'
+    images = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.uint8,
+        shape=(len(identities), len(morphs), height, width, 3))
+    for n, ((identity, morph), name) in enumerate(sorted(files.items())):
+        with Image.open(os.path.join(face_path, name)) as im:
+            im = im.convert('RGB')
+        if im.size != (width, height):
+            raise ValueError(f"{name} is {im.size[0]}x{im.size[1]}, expected {width}x{height}")
+        images[identities.index(identity), morphs.index(morph)] = np.asarray(im)
+        if progress is not None:
+            progress(n+1, len(files))
+    images.flush()
+    del images
+    os.replace(tmp, out)
+    with open(_index_path(out), 'w') as f:
+        json.dump({'identities': identities, 'morphs': morphs,
+                   'present': sorted([i, m] for i, m in files)}, f)
+    return FacePack(out)
+
+class FacePack:
+    def __init__(self, fname):
+        self.fname = fname
+        self.images = np.load(fname, mmap_mode='r')
+        with open(_index_path(fname)) as f:
+            index = json.load(f)
+        identities = {identity: i for i, identity in enumerate(index['identities'])}
+        morphs = {morph: j for j, morph in enumerate(index['morphs'])}
+        self._index = {('face', identity, morph): (identities[identity], morphs[morph])
+                       for identity, morph in index['present']}
+
+    @classmethod
+    def open(cls, fname):
+        # the pack at fname, or None if it hasn't been built
+        if os.path.exists(fname) and os.path.exists(_index_path(fname)):
+            return cls(fname)
+        return None
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __getitem__(self, key):
+        # (H, W, 3) uint8 view of a face_key(); nothing is read until it is used
+        return self.images[self._index[key]]
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    face_path = argv[0] if argv else os.path.join('stimuli', 'face_triangles')
+    def progress(i, n):
+        if i % 100 == 0 or i == n:
+            print(f"\rpacking {face_path}: {i}/{n}", end='', flush=True)
+    pack = build_pack(face_path, progress=progress)
+    print(f"\n{len(pack)} faces, {pack.images.shape} -> {pack.fname}")
+
+if __name__ == '__main__':
+    sys.exit(main())
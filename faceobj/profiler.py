@@ -0,0 +1,146 @@
+'''
+Opt-in hot-path profiler
+
+Records the duration of individual calls (setImage, draw, flip, saving a
+trial, ...) into a preallocated ring buffer and summarises them as
+per-operation percentiles and log-spaced histograms at the end of the
+session. Nothing is timed unless a Profiler is enabled: instrument() only
+wraps methods when it is, and a disabled Profiler's section() returns a
+shared no-op context manager.
+
+profiler = Profiler()
+profiler.instrument(win, 'flip')
+profiler.instrument(image_stim, 'setImage')
+with profiler.section('compact'):
+    ...
+print(profiler.summary())
+'''
+
+import time
+import functools
+import numpy as np
+
+# histogram bin edges in ms, log-spaced from 10 us to 1 s
+HIST_EDGES = np.concatenate(([0], np.logspace(-2, 3, 21), [np.inf]))
+
+class _NullSection:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SECTION = _NullSection()
+
+class _Section:
+    def __init__(self, profiler, code):
+        self.profiler = profiler
+        self.code = code
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._record(self.code, time.perf_counter() - self.start)
+        return False
+
+class Profiler:
+    '''
+    Ring buffer of the last size call durations. With enabled=False every
+    hook is a no-op.
+    '''
+    def __init__(self, size=65536, enabled=True):
+        self.enabled = enabled
+        self.size = size
+        self.names = []
+        self._codes = {}
+        self.code = np.zeros(size if enabled else 0, dtype='i2')
+        self.dur = np.zeros(size if enabled else 0, dtype='f8')
+        self.n = 0 # calls recorded, including ones overwritten in the ring
+
+    def _code(self, name):
+        code = self._codes.get(name)
+        if code is None:
+            code = self._codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+    def _record(self, code, dt):
+        i = self.n % self.size
+        self.code[i] = code
+        self.dur[i] = dt
+        self.n += 1
+
+    def record(self, name, dt):
+        # add a duration (s) measured elsewhere
+        if self.enabled:
+            self._record(self._code(name), dt)
+
+    def section(self, name):
+        # context manager timing its block
+        if not self.enabled:
+            return _NULL_SECTION
+        return _Section(self, self._code(name))
+
+    def wrap(self, name):
+        # decorator timing every call of a function
+        def decorator(func):
+            if not self.enabled:
+                return func
+            code = self._code(name)
+            @functools.wraps(func)
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self._record(code, time.perf_counter() - start)
+            return timed
+        return decorator
+
+    def instrument(self, obj, method, name=None):
+        # time every call of obj.method (on this instance only) as name
+        if self.enabled:
+            setattr(obj, method, self.wrap(name or method)(getattr(obj, method)))
+        return obj
+
+    def durations(self, name):
+        # recorded durations (ms) of name that are still in the ring
+        code = self._codes.get(name)
+        n = min(self.n, self.size)
+        if code is None:
+            return np.zeros(0)
+        return self.dur[:n][self.code[:n] == code]*1000
+
+    def histograms(self):
+        # {name: counts per HIST_EDGES bin}
+        return {name: np.histogram(self.durations(name), HIST_EDGES)[0] for name in self.names}
+
+    def report(self):
+        rows = []
+        for name in self.names:
+            ms = self.durations(name)
+            if len(ms):
+                p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+                rows.append(dict(name=name, n=len(ms), total_ms=ms.sum(), mean_ms=ms.mean(),
+                    p50_ms=p50, p95_ms=p95, p99_ms=p99, max_ms=ms.max()))
+        return rows
+
+    def summary(self):
+        lines = []
+        if self.n > self.size:
+            lines.append(f"(only the last {self.size} of {self.n} calls are kept)")
+        for row in self.report():
+            lines.append(f"{row['name']}: n={row['n']} mean={row['mean_ms']:.3f}ms p95={row['p95_ms']:.3f}ms p99={row['p99_ms']:.3f}ms max={row['max_ms']:.3f}ms")
+        return "\n".join(lines)
+
+    def save(self, fname):
+        # report() plus the histogram counts, one column per bin (upper edge in ms)
+        columns = ['name', 'n', 'total_ms', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms']
+        hists = self.histograms()
+        with open(fname, 'w') as f:
+            f.write("\t".join(columns + [f"le_{edge:g}ms" for edge in HIST_EDGES[1:]])+"\n")
+            for row in self.report():
+                values = [row['name'], str(row['n'])] + [f"{row[c]:.4f}" for c in columns[2:]]
+                f.write("\t".join(values + [str(c) for c in hists[row['name']]])+"\n")
@@ -0,0 +1,139 @@
+'''
+3AFC result schema and streaming writer
+
+Each trial is appended as one tab-separated line (flushed every trial,
+fsync'ed every few trials), so the per-trial cost is constant and a crash
+leaves every completed trial on disk. At the end of the session the stream
+is compacted into <filename>_objafc.npy, a structured array with fixed
+dtypes (AFC_DTYPE) that loads without pickle and can be memory-mapped:
+
+data = np.load('data/sub-#/sub-#_sequential_objafc.npy', mmap_mode='r')
+data['resp_rt'][data['afc_resp'] == AFC_RESP.index('corr')]
+'''
+
+import os
+import numpy as np
+
+# categorical columns are stored as int8 codes into these lists
+AFC_RESP = ['none', 'corr', 'lure', 'novel']
+CONDITIONS = ['sequential', 'simultaneous']
+CATEGORIES = {'afc_resp': AFC_RESP, 'condition': CONDITIONS}
+
+# response for each key position (1/2/3), given where the correct object is
+AFC_CODES = [['corr','novel','lure'], # corr_loc 0: obj, rand_obj, alt_obj
+             ['lure','corr','novel'], # corr_loc 1: alt_obj, obj, rand_obj
+             ['novel','lure','corr']] # corr_loc 2: rand_obj, alt_obj, obj
+
+# one record per 3AFC trial; resp_rt is NaN when there was no response,
+# onset is the 3AFC screen onset in seconds from the start of the task
+AFC_DTYPE = np.dtype([
+    ('sub', 'i4'), ('condition', 'i1'), ('block', 'i2'), ('repetition', 'i2'),
+    ('trial', 'i2'), ('face', 'i2'), ('obj', 'i2'), ('alt_obj', 'i2'),
+    ('rand_obj', 'i2'), ('corr_loc', 'i1'), ('afc_resp', 'i1'),
+    ('resp_rt', 'f8'), ('onset', 'f8')])
+
+class TrialWriter:
+    def __init__(self, fname, dtype=AFC_DTYPE, fsync_every=4, append=False):
+        self.fname = fname
+        self.fields = dtype.names
+        self.fsync_every = fsync_every
+        self.n = 0
+        new = not append or not os.path.exists(fname) or os.path.getsize(fname) == 0
+        self._f = open(fname, 'a' if append else 'w')
+        if new:
+            self._f.write("\t".join(self.fields)+"\n")
+            self._sync()
+
+    def _sync(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def write(self, **trial):
+        # categorical columns are written as their labels to keep the stream readable
+        self._f.write("\t".join(str(trial[name]) for name in self.fields)+"\n")
+        self.n += 1
+        if self.n % self.fsync_every == 0:
+            self._sync()
+        else:
+            self._f.flush()
+
+    def close(self):
+        if not self._f.closed:
+            self._sync()
+            self._f.close()
+
+def _value(name, value):
+    if name in CATEGORIES:
+        return CATEGORIES[name].index(value)
+    return float(value)
+
+def read_trials(fname, dtype=AFC_DTYPE):
+    # structured array of every complete line (a torn final line is dropped)
+    rows = []
+    with open(fname) as f:
+        header = f.readline().rstrip("\n").split("\t")
+        for line in f:
+            values = line.rstrip("\n").split("\t")
+            if not line.endswith("\n") or len(values) != len(header):
+                break
+            row = dict(zip(header, values))
+            rows.append(tuple(_value(name, row[name]) for name in dtype.names))
+    trials = np.array(rows, dtype=dtype)
+    trials['resp_rt'][trials['afc_resp'] == AFC_RESP.index('none')] = np.nan
+    return trials
+
+def truncate_trials(fname, n):
+    '''
+    Keep the header and at most the first n complete lines of a trial stream
+    (e.g. to drop a torn line before appending to it). Returns the number of
+    lines kept.
+    '''
+    with open(fname) as f:
+        header = f.readline()
+        lines = []
+        for line in f:
+            if len(lines) == n or not line.endswith("\n"):
+                break
+            lines.append(line)
+    tmp = fname+'.tmp'
+    with open(tmp, 'w') as f:
+        f.write(header+''.join(lines))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, fname)
+    return len(lines)
+
+def compact(fname, out):
+    # save the streamed trials as <out>.npy, replacing any previous file atomically
+    trials = read_trials(fname)
+    tmp = out+'.tmp.npy'
+    np.save(tmp, trials)
+    os.replace(tmp, out+'.npy')
+    return trials
+
+def from_legacy(results, sub, condition):
+    # convert an old pickled dict-of-lists _objafc.npy; missing columns are -1/NaN
+    n = len(results['face'])
+    trials = np.zeros(n, dtype=AFC_DTYPE)
+    trials['sub'] = sub
+    trials['condition'] = CONDITIONS.index(condition)
+    trials['trial'] = np.arange(n)
+    for name in ['face', 'obj', 'alt_obj']:
+        trials[name] = results[name]
+    trials['rand_obj'] = results['rand_obj'] if len(results['rand_obj']) == n else -1
+    trials['corr_loc'] = -1
+    trials['block'] = -1
+    trials['repetition'] = -1
+    trials['afc_resp'] = [AFC_RESP.index(r) for r in results['afc_resp']]
+    trials['resp_rt'] = np.where(trials['afc_resp'] == 0, np.nan, results['resp_rt'])
+    trials['onset'] = np.nan
+    return trials
+
+def load_afc(fname, mmap=True):
+    # structured 3AFC trials from a _objafc.npy, memory-mapped unless it is an old pickled dict
+    try:
+        return np.load(fname, mmap_mode='r' if mmap else None, allow_pickle=False)
+    except ValueError:
+        results = np.load(fname, allow_pickle=True).item()
+        sub_name, condition = os.path.basename(fname).split('_')[:2]
+        return from_legacy(results, int(sub_name.split('-')[1]), condition)
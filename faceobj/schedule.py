@@ -0,0 +1,246 @@
+'''
+Trial order generation
+
+shuffle_without_backtoback() draws a uniformly random ordering of the
+face-object pairs in which no two consecutive trials show the same face
+identity (a face and its doppelganger share abs(face)). Instead of
+reshuffling until the constraint happens to hold, it counts the valid
+completions of every partial ordering (memoised over how many identities
+have 1 or 2 items left) and samples each position with the right weight,
+so it never retries and reports infeasible inputs up front. An identity
+never has more than two items (a face and its doppelganger), and
+constrained_shuffle() is limited to that case: with n items there are
+O(n^2) (singles, pairs) states, each holding a count that grows like n!,
+which is instant for the task's up to 48 trials and about half a second
+for 300 pairs. Groups of three or more would need the whole multiset of
+group sizes in the state, which grows exponentially.
+
+compile_session() draws every random choice of a session (stimulus
+selection, trial orders, 3AFC foils and locations, simultaneous target
+side) from sub_num before the window opens. The result is one structured
+array of trial records that can be saved next to the data, and the task
+loops only index into it. The face-object pairs are looked up through a
+PairingIndex, so compiling a session stays linear in its number of trials
+for any number of identities and objects.
+'''
+
+import random
+import numpy as np
+
+STUDY, TEST = 0, 1
+
+# face identities in stimuli/face_triangles (1-24)
+NUM_IDENTITIES = 24
+
+# one record per study or test trial; unused columns are -1
+SCHEDULE_DTYPE = np.dtype([
+    ('phase', 'i1'), ('block', 'i2'), ('repetition', 'i2'), ('trial', 'i2'),
+    ('face', 'i2'), ('obj', 'i2'), ('alt_obj', 'i2'), ('rand_obj', 'i2'),
+    ('target_loc', 'i1'), ('corr_loc', 'i1'), ('display_ms', 'f4'),
+    ('isi_ms', 'f4'), ('iti_ms', 'f4'), ('afc_ms', 'f4')])
+
+# (counts, last) -> _completions(counts, last), shared by all sessions
+_completion_counts = {}
+
+def _children(counts, last):
+    # (weight, state) of every group size that can be picked next
+    for s, c in enumerate(counts, 1):
+        groups = c - (last == s)
+        if groups > 0:
+            yield groups * s, (_take(counts, s), s-1)
+
+def _completions(counts, last):
+    '''
+    Number of valid orderings of the remaining items. counts[s-1] is how many
+    groups have s items left; last is how many items the group placed last
+    has left (0 for none), so that group can't be picked next. Memoised and
+    evaluated with an explicit stack, so long sessions need no deep recursion.
+    '''
+    memo = _completion_counts
+    stack = [(counts, last)]
+    while stack:
+        state = stack[-1]
+        if state in memo:
+            stack.pop()
+            continue
+        children = list(_children(*state))
+        missing = [child for _, child in children if child not in memo]
+        if missing:
+            stack.extend(missing)
+            continue
+        memo[state] = sum(w * memo[child] for w, child in children) if any(state[0]) else 1
+        stack.pop()
+    return memo[(counts, last)]
+
+def _take(counts, s):
+    counts = list(counts)
+    counts[s-1] -= 1
+    if s > 1:
+        counts[s-2] += 1
+    return tuple(counts)
+
+def count_orderings(groups):
+    # number of orderings of the items with no two consecutive items from the same group
+    sizes = [len(items) for items in groups.values()]
+    counts = tuple(sizes.count(s) for s in range(1, max(sizes, default=0)+1))
+    return _completions(counts, 0)
+
+def constrained_shuffle(items, key, rng=random):
+    '''
+    Uniformly random ordering of items with key(a) != key(b) for every pair
+    of neighbours, where at most two items share a key (see the module
+    docstring for why). Raises ValueError if a key has more items or no
+    valid ordering exists.
+    '''
+    groups = {}
+    for item in items:
+        groups.setdefault(key(item), []).append(item)
+    if not groups:
+        return []
+    if max(len(g) for g in groups.values()) > 2:
+        raise ValueError("constrained_shuffle takes at most two items per key")
+    if count_orderings(groups) == 0:
+        raise ValueError("no ordering without back-to-back repeats exists for these items")
+    return _sample(groups, rng)
+
+def _sample(groups, rng):
+    # buckets[s-1] holds the groups (lists of their remaining items) with s items left
+    max_size = max(len(g) for g in groups.values())
+    buckets = [[] for _ in range(max_size)]
+    for items in groups.values():
+        buckets[len(items)-1].append(list(items))
+    counts = tuple(len(b) for b in buckets)
+    order = []
+    last = None
+    while any(counts):
+        last_size = len(last) if last else 0
+        options = []
+        for s, c in enumerate(counts, 1):
+            n = c - (last_size == s)
+            if n > 0:
+                options.append((n * s * _completions(_take(counts, s), s-1), s))
+        pick = rng.randrange(sum(w for w, _ in options))
+        for w, s in options:
+            if pick < w:
+                break
+            pick -= w
+        # uniform group of that size (not the last one), then a uniform item from it
+        bucket = buckets[s-1]
+        while True:
+            i = rng.randrange(len(bucket))
+            if bucket[i] is not last:
+                break
+        group = bucket[i]
+        bucket[i] = bucket[-1]
+        bucket.pop()
+        order.append(group.pop(rng.randrange(len(group))))
+        if group:
+            buckets[s-2].append(group)
+        counts = _take(counts, s)
+        last = group
+    return order
+
+def shuffle_without_backtoback(faces, objects, rng=random):
+    # (face, object) pairs in random order with no identity (abs(face)) twice in a row;
+    # every face has its own object, so no object is shown twice in a row either
+    return constrained_shuffle(list(zip(faces, objects)), key=lambda pair: abs(pair[0]), rng=rng)
+
+def balanced_positions(n, n_positions, rng=random):
+    # n positions in random order, each of 0..n_positions-1 used equally often (+-1)
+    positions = [i % n_positions for i in range(n)]
+    rng.shuffle(positions)
+    return positions
+
+def session_stimuli(sub_num, num_study_stim, num_objects=None):
+    '''
+    Face ids and their objects. Identities start at 5 and wrap around to 1
+    after 24; the objects are drawn from the first num_objects (default
+    2*num_study_stim) objects.
+    '''
+    if num_study_stim//2 > NUM_IDENTITIES:
+        raise ValueError(f"num_study_stim={num_study_stim} needs more than the {NUM_IDENTITIES} face identities")
+    num_objects = num_objects or num_study_stim*2
+    if num_objects < num_study_stim:
+        raise ValueError(f"num_objects={num_objects} is less than num_study_stim={num_study_stim}")
+    # negative face ids are the doppelgangers (aka pair B) of the positive ones
+    faces = (np.arange(num_study_stim//2) + 4) % NUM_IDENTITIES + 1
+    objects = np.random.RandomState(int(sub_num)).permutation(np.arange(num_objects))
+    objects = objects[:num_study_stim] # 3 face spaces means 6 total associations
+    return np.hstack((faces,-faces)), objects
+
+class PairingIndex:
+    '''
+    Face id -> object lookups of one session, precomputed once: the studied
+    object, the doppelganger's object (the 3AFC lure) and the objects that
+    can be the novel foil (neither of the two).
+    '''
+    def __init__(self, faces, objects):
+        self.objects = tuple(objects)
+        self.obj = dict(zip(faces, objects))
+        self.lure = {face: self.obj[-face] for face in faces}
+        self.foils = {face: tuple(o for o in self.objects if o != self.obj[face] and o != self.lure[face])
+                      for face in faces}
+
+    def foil(self, face, rng):
+        return rng.choice(self.foils[face])
+
+    def unique_foils(self, faces, rng):
+        '''
+        One foil per face in faces, drawn without replacement from the
+        shuffled objects: no object is a foil twice before every object has
+        been one (it is refilled when no eligible object is left).
+        '''
+        deck, picks = [], []
+        for face in faces:
+            excluded = (self.obj[face], self.lure[face])
+            # deck holds distinct objects, so at most 3 are looked at
+            i = next((i for i in range(len(deck)-1, -1, -1) if deck[i] not in excluded), None)
+            if i is None:
+                deck = list(self.objects)
+                rng.shuffle(deck)
+                i = next(i for i in range(len(deck)-1, -1, -1) if deck[i] not in excluded)
+            deck[i], deck[-1] = deck[-1], deck[i]
+            picks.append(deck.pop())
+        return picks
+
+def compile_session(sub_num, experiment_type, num_blocks, num_study_repetitions,
+                    num_study_stim, display_time, isi, iti, afc_time, balanced=False,
+                    num_objects=None, unique_foils=False):
+    '''
+    SCHEDULE_DTYPE array of every study and test trial of a session. The same
+    arguments always give the same schedule. With balanced=True each 3AFC
+    location is correct equally often within a block instead of at random.
+    With unique_foils=True the novel foils of a test block are drawn without
+    replacement (PairingIndex.unique_foils) instead of independently.
+    '''
+    faces, objects = session_stimuli(sub_num, num_study_stim, num_objects)
+    index = PairingIndex(faces, objects)
+    rng = random.Random(int(sub_num))
+    rows = []
+    for block in range(num_blocks):
+        for repetition in range(num_study_repetitions):
+            for trial, (face, obj) in enumerate(shuffle_without_backtoback(faces, objects, rng)):
+                # target_loc 0 means the to-be-highlighted face will be on the left
+                target_loc = rng.randrange(2) if experiment_type == 'simultaneous' else -1
+                rows.append((STUDY, block, repetition, trial, face, obj, -1, -1,
+                             target_loc, -1, display_time, isi, iti, -1))
+        test = shuffle_without_backtoback(faces, objects, rng)
+        if balanced:
+            corr_locs = balanced_positions(len(test), 3, rng)
+        else:
+            corr_locs = [rng.randrange(3) for _ in test]
+        if unique_foils:
+            foils = index.unique_foils([face for face, _ in test], rng)
+        for trial, ((face, obj), corr_loc) in enumerate(zip(test, corr_locs)):
+            alt_obj = index.lure[face] # object of the doppelganger
+            rand_obj = foils[trial] if unique_foils else index.foil(face, rng)
+            rows.append((TEST, block, num_study_repetitions, trial, face, obj, alt_obj, rand_obj,
+                         -1, corr_loc, display_time, isi, iti, afc_time))
+    return np.array(rows, dtype=SCHEDULE_DTYPE)
+
+def select_rows(schedule, phase, block, repetition=None):
+    # schedule indices of one study repetition or one test phase, in presentation order
+    mask = (schedule['phase'] == phase) & (schedule['block'] == block)
+    if repetition is not None:
+        mask &= schedule['repetition'] == repetition
+    return np.flatnonzero(mask)
@@ -0,0 +1,121 @@
+'''
+In-memory stimulus cache
+
+Every face/object image a session needs is decoded once at startup, so the
+timed study and 3AFC phases only swap already-decoded images into the
+ImageStims instead of re-reading and re-decoding JPEGs from disk each trial.
+prefetch() does the decoding on a thread pool in the background (PIL
+releases the GIL while decoding), so the task can show its instructions
+while the images load.
+'''
+
+import threading
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from PIL import Image
+
+def face_key(face, distance):
+    # doppelgangers are stored as negative face ids; the image is the same identity.
+    # distance stays fractional only if it is (generated morphs, faceobj.morph)
+    distance = float(distance)
+    return ('face', abs(int(face)), int(distance) if distance.is_integer() else distance)
+
+def obj_key(obj):
+    return ('obj', int(obj))
+
+class StimulusCache:
+    '''
+    Bounded LRU cache of decoded RGB images keyed by face_key()/obj_key().
+
+    resolve(key) must return the image file for a key, or the image itself as
+    an (H, W, 3) uint8 array (faceobj.pack). Images are decoded with PIL and
+    can be passed straight to ImageStim.setImage().
+    '''
+    def __init__(self, resolve, maxsize=64):
+        self.resolve = resolve
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._images = OrderedDict()
+        self._pending = {} # key: Future of images still being prefetched
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._images)
+
+    def __contains__(self, key):
+        return key in self._images
+
+    def _decode(self, key):
+        source = self.resolve(key)
+        if isinstance(source, np.ndarray):
+            return Image.fromarray(np.ascontiguousarray(source)) # already decoded, e.g. a memory-mapped pack
+        with Image.open(source) as im:
+            im = im.convert('RGB') # convert() forces the full decode now
+        return im
+
+    def _store(self, key, im):
+        with self._lock:
+            self._images[key] = im
+            self._images.move_to_end(key)
+            while len(self._images) > self.maxsize:
+                self._images.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            im = self._images.get(key)
+            pending = self._pending.get(key)
+            if im is not None:
+                self.hits += 1
+                self._images.move_to_end(key)
+                return im
+        if pending is not None:
+            # still being prefetched: wait for that decode instead of starting another
+            im = pending.result()
+            self.hits += 1
+            return im
+        # should not happen during a session if prefetch() covered every stimulus
+        self.misses += 1
+        im = self._decode(key)
+        self._store(key, im)
+        return im
+
+    def prefetch(self, keys, workers=None, progress=None):
+        '''
+        Decode keys on a thread pool in the background. Returns a Future that
+        is done (result: number of images decoded) once all of them are in the
+        cache, or holds the first decoding error. progress(i, n) is called
+        from the worker threads as images finish, so it must not draw.
+        '''
+        keys = [key for key in dict.fromkeys(keys) if key not in self]
+        if len(keys) > self.maxsize:
+            print(f"WARNING: prefetching {len(keys)} stimuli into a cache of size {self.maxsize}, some will be evicted")
+        ready = Future()
+        remaining = [len(keys)]
+        if not keys:
+            ready.set_result(0)
+            return ready
+        def finished(key, future):
+            with self._lock:
+                del self._pending[key]
+                error = future.exception()
+                if error is None:
+                    self._store(key, future.result())
+                remaining[0] -= 1
+                i = len(keys) - remaining[0]
+            if error is not None:
+                if not ready.done():
+                    ready.set_exception(error)
+                return
+            if progress is not None:
+                progress(i, len(keys))
+            if i == len(keys) and not ready.done():
+                ready.set_result(len(keys))
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stim-prefetch')
+        with self._lock:
+            for key in keys:
+                future = self._pending[key] = pool.submit(self._decode, key)
+                future.add_done_callback(lambda future, key=key: finished(key, future))
+        pool.shutdown(wait=False)
+        return ready
@@ -0,0 +1,117 @@
+'''
+Study phases
+
+The only part of the session that differs between the sequential and the
+simultaneous task. A StudyPhase presents one study trial (a SCHEDULE_DTYPE
+record) with the engine's stimuli; setup()/teardown() run around each
+block's study repetitions, and prepare() runs for each trial while the
+screen before it (instructions or the previous ITI) is up. Add a paradigm by subclassing StudyPhase and
+registering it in STUDY_PHASES.
+'''
+
+class StudyPhase:
+    name = ''
+    instructions = ''
+
+    def setup(self, engine):
+        pass
+
+    def prepare(self, engine, t):
+        pass
+
+    def trial(self, engine, t):
+        raise NotImplementedError
+
+    def teardown(self, engine):
+        pass
+
+class SequentialStudy(StudyPhase):
+    name = 'sequential'
+    instructions = 'Memorize the face-object pairs. Face-pairs will be presented one-at-a-time, first showing a face followed by its object association.'
+
+    def trial(self, engine, t):
+        # Study Face
+        engine.image_stim.setImage(engine.face_image(t['face']))
+        engine.show([engine.image_stim], t['display_ms'], label='study_face')
+
+        # ISI
+        engine.show([engine.fixColor], t['isi_ms'], label='isi')
+
+        # Study Scene/Object
+        engine.image_stim.setImage(engine.obj_image(t['obj']))
+        engine.show([engine.image_stim], t['display_ms'], label='study_obj')
+
+        # ITI
+        engine.show([engine.fixColor], t['iti_ms'], label='iti')
+
+class SimultaneousStudy(StudyPhase):
+    name = 'simultaneous'
+    instructions = 'Memorize the face-object pairs. Two faces will be presented together on the screen, then one face will be highlighted.\nAn object will then appear, and the task is to\nmemorize the object paired with the highlighted face.'
+
+    _prepared = (None, None, None)
+
+    def _resize(self, engine, size, line_width):
+        engine.image_left.size = size
+        engine.image_right.size = size
+        engine.left_outline.size = size
+        engine.left_outline.lineWidth = line_width
+        engine.right_outline.size = size
+        engine.right_outline.lineWidth = line_width
+
+    def setup(self, engine):
+        # increase sizes for images from default
+        self._resize(engine, engine.geometry.study_size, 40)
+
+    def teardown(self, engine):
+        # reset size for subsequent 3AFC
+        self._resize(engine, engine.geometry.afc_size, 20)
+
+    def _set_faces(self, engine, face, target_loc):
+        # the highlighted face and its partner (same identity, other morph distance)
+        target, partner = engine.face_image(face), engine.face_image(-face)
+        if target_loc==0: # target_loc 0 means the to-be-highlighted face will be on the left
+            engine.image_left.setImage(target)
+            engine.image_right.setImage(partner)
+        else:
+            engine.image_right.setImage(target)
+            engine.image_left.setImage(partner)
+
+    def _highlight(self, engine, target_loc):
+        if target_loc==0:
+            return engine.left_outline
+        return engine.right_outline
+
+    def prepare(self, engine, t):
+        # both face screens of the trial, composed off-screen
+        self._set_faces(engine, t['face'], t['target_loc'])
+        highlight = self._highlight(engine, t['target_loc'])
+        highlight.lineColor=[.5,.5,0] # yellow
+        faces = engine.compose([engine.image_left,engine.image_right])
+        highlighted = engine.compose([highlight,engine.image_left,engine.image_right])
+        highlight.lineColor=[-1,-1,-1]
+        self._prepared = (t['block'], t['repetition'], t['trial']), faces, highlighted
+
+    def trial(self, engine, t):
+        if self._prepared[0] != (t['block'], t['repetition'], t['trial']):
+            self.prepare(engine, t)
+        _, faces, highlighted = self._prepared
+        # Study Face
+        engine.show(faces, t['display_ms'], label='study_faces')
+
+        # Highlight time (the same faces, so nothing is reloaded)
+        highlight = self._highlight(engine, t['target_loc'])
+        highlight.lineColor=[.5,.5,0] # yellow
+        engine.show(highlighted, t['display_ms'], label='highlight')
+        highlight.lineColor=[-1,-1,-1]
+
+        # ISI
+        engine.show([engine.fixColor], t['isi_ms'], label='isi')
+
+        # Study Scene/Object
+        engine.image_stim.setImage(engine.obj_image(t['obj']))
+        engine.show([engine.image_stim], t['display_ms'], label='study_obj')
+
+        # ITI
+        engine.show([engine.fixColor], t['iti_ms'], label='iti')
+
+STUDY_PHASES = {phase.name: phase for phase in [SequentialStudy, SimultaneousStudy]}
@@ -0,0 +1,170 @@
+'''
+Upload-once image textures
+
+ImageStim.setImage() re-uploads the pixels to the GPU every time an image
+is swapped in. TexturePool instead keeps one ImageStim per unique stimulus,
+created (and uploaded) once at the source resolution, and ImageSlot stands
+in for a positioned ImageStim (image_stim, image_left, ...): setImage(key)
+only points the slot at the pooled texture and moves it into place, so a
+trial uploads nothing. The pool counts uploads and the GPU memory its
+textures take, and interpolation is set explicitly for every texture.
+Pooled textures don't log image changes, so with log_level set a named
+slot logs "<name>: image = <key>" on the next flip, like ImageStim does.
+
+python -m faceobj.texpool --offscreen # upload/swap benchmark, e.g. on a CI machine with Mesa
+'''
+
+import sys
+import time
+import argparse
+import numpy as np
+
+# PsychoPy converts RGB images to RGBA and uploads them as GL_FLOAT textures
+BYTES_PER_TEXEL = 4*4
+
+class TexturePool:
+    def __init__(self, win, visual, load, tex_res=256, interpolate=False, units='deg', log_level=None):
+        # load(key) returns the decoded image of a stimulus key (e.g. StimulusCache.get)
+        self.win = win
+        self.visual = visual
+        self.units = units
+        self.load = load
+        self.tex_res = tex_res
+        self.interpolate = interpolate
+        self.log_level = log_level
+        self.uploads = 0
+        self.upload_s = 0.0
+        self.nbytes = 0
+        self._stims = {}
+
+    def __len__(self):
+        return len(self._stims)
+
+    def __contains__(self, key):
+        return key in self._stims
+
+    def upload(self, keys):
+        # create the textures of keys now (e.g. before the session) instead of on first use
+        for key in keys:
+            self[key]
+
+    def __getitem__(self, key):
+        stim = self._stims.get(key)
+        if stim is None:
+            image = self.load(key)
+            start = time.perf_counter()
+            stim = self.visual.ImageStim(win=self.win, units=self.units,
+                image=image, mask=None, ori=0, pos=(0, 0), size=None,
+                color=[1,1,1], colorSpace='rgb', opacity=1,
+                flipHoriz=False, flipVert=False,
+                texRes=self.tex_res, interpolate=self.interpolate, depth=0.0)
+            self.upload_s += time.perf_counter() - start
+            self.uploads += 1
+            width, height = getattr(image, 'size', (self.tex_res, self.tex_res))
+            self.nbytes += width*height*BYTES_PER_TEXEL
+            self._stims[key] = stim
+        return stim
+
+    def slot(self, pos, size, name=None):
+        return ImageSlot(self, pos, size, name)
+
+    def summary(self):
+        return (f"{len(self)} textures, {self.nbytes/2**20:.1f} MiB of GPU memory, "
+                f"{self.uploads} uploads in {self.upload_s*1000:.1f} ms")
+
+class ImageSlot:
+    '''
+    A position and size on screen showing one pooled texture at a time.
+    Has the parts of the ImageStim interface the task uses.
+    '''
+    def __init__(self, pool, pos, size, name=None):
+        self.pool = pool
+        self.name = name
+        self._pos = tuple(pos)
+        self._size = (size, size) if np.isscalar(size) else tuple(size)
+        self.stim = None
+
+    def setImage(self, key):
+        self.stim = self.pool[key]
+        self._place()
+        if self.name and self.pool.log_level is not None:
+            label = '_'.join(map(str, key)) if isinstance(key, tuple) else key
+            self.pool.win.logOnFlip(f"{self.name}: image = {label}", level=self.pool.log_level)
+
+    def _place(self):
+        if self.stim is None:
+            return
+        # only touch the stim when it was last placed elsewhere (changing pos/size re-computes vertices)
+        if tuple(self.stim.pos) != self._pos:
+            self.stim.pos = self._pos
+        if self.stim.size is None or tuple(self.stim.size) != self._size:
+            self.stim.size = self._size
+
+    @property
+    def win(self):
+        # BufferImageStim only draws stims that belong to its window
+        return self.pool.win
+
+    @property
+    def pos(self):
+        return self._pos
+
+    @pos.setter
+    def pos(self, pos):
+        self._pos = tuple(pos)
+        self._place()
+
+    @property
+    def size(self):
+        return self._size
+
+    @size.setter
+    def size(self, size):
+        self._size = tuple(size)
+        self._place()
+
+    def draw(self, win=None):
+        if self.stim is not None:
+            self._place() # another slot may have moved the same texture
+            self.stim.draw(win)
+
+def main(argv=None):
+    # time per-trial image swaps with setImage() against the pool on a (hidden) window
+    parser = argparse.ArgumentParser(description="Benchmark texture uploads vs. pooled textures")
+    parser.add_argument('--offscreen', action='store_true', help="pyglet headless (EGL) context, no display needed")
+    parser.add_argument('--images', type=int, default=12)
+    parser.add_argument('--swaps', type=int, default=200)
+    parser.add_argument('--size', type=int, default=256)
+    args = parser.parse_args(argv)
+    if args.offscreen:
+        import pyglet
+        pyglet.options['headless'] = True
+    from psychopy import visual
+    from PIL import Image
+    win = visual.Window(size=[args.size*2, args.size*2], units='pix', fullscr=False)
+    rng = np.random.default_rng(0)
+    images = [Image.fromarray(rng.integers(0, 256, (args.size, args.size, 3), dtype=np.uint8))
+              for _ in range(args.images)]
+    stim = visual.ImageStim(win, image=images[0], units='pix', size=args.size, texRes=args.size)
+    start = time.perf_counter()
+    for i in range(args.swaps):
+        stim.setImage(images[i % len(images)])
+        stim.draw()
+    win.flip()
+    upload_ms = (time.perf_counter() - start)/args.swaps*1000
+    pool = TexturePool(win, visual, lambda key: images[key], tex_res=args.size, units='pix')
+    pool.upload(range(len(images)))
+    slot = pool.slot((0, 0), (args.size, args.size))
+    start = time.perf_counter()
+    for i in range(args.swaps):
+        slot.setImage(i % len(images))
+        slot.draw()
+    win.flip()
+    pooled_ms = (time.perf_counter() - start)/args.swaps*1000
+    mb = args.size**2*BYTES_PER_TEXEL/2**20
+    print(f"setImage: {upload_ms:.3f} ms/swap ({mb/upload_ms*1000:.0f} MiB/s uploaded)")
+    print(f"pooled:   {pooled_ms:.3f} ms/swap; {pool.summary()}")
+    win.close()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,203 @@
+'''
+Frame-locked presentation timing
+
+Durations are scheduled in whole frames of the measured frame duration and
+every screen is redrawn and flipped once per frame, so stimulus offsets land
+on vsync instead of on a 20 ms sleep grid. Frames are counted on the flip
+clock from the onset flip, so a frame dropped or spent in a screen's
+prepare() callback shortens the rest of the screen instead of delaying the
+next onset. Responses come from the
+psychopy.hardware.keyboard event queue, whose clock is reset on the onset
+flip, so RTs carry the keyboard backend's timestamps (sub-millisecond with
+the psychtoolbox backend) rather than the time the loop happened to poll.
+
+FrameLog holds the per-screen timing record without touching PsychoPy, so
+headless runs (faceobj.headless) produce the same timing report. It also
+keeps the timestamp of every flip, tagged with the screen (label and trial)
+it belongs to, in a preallocated array; frame_report() turns those into
+per-screen-type frame-interval percentiles, dropped-frame counts and
+flip-to-onset latencies. The flip timestamps come straight from win.flip(),
+so no separate win.recordFrameIntervals pass is needed.
+'''
+
+import os
+import numpy as np
+
+def to_frames(ms, frame_dur):
+    # nearest whole number of frames, never less than one
+    return max(1, int(round(ms / 1000 / frame_dur)))
+
+# one record per flip; screen indexes FrameLog.events
+FLIP_DTYPE = np.dtype([('screen', 'i4'), ('t', 'f8')])
+
+class FrameLog:
+    '''
+    Requested and actual duration (onset flip to the onset flip of the
+    following screen) of every screen shown, and the time of every flip.
+    Set trial to tag the following screens with a trial index (-1 for none).
+    '''
+    def __init__(self, frame_dur):
+        self.frame_dur = frame_dur
+        self.trial = -1
+        self.events = [] # [label, trial, target_s, onset, actual_s, latency_s]
+        self.onset = None # flip time of the most recent screen onset
+        self.n_frames = {} # {ms: frames} of the configured durations, see set_frame_counts()
+        self._pending = None
+        self.flips = np.zeros(4096, dtype=FLIP_DTYPE)
+        self.n_flips = 0
+
+    def set_frame_counts(self, counts):
+        # keyed like the schedule's float32 durations so a lookup needs no conversion
+        self.n_frames = {float(np.float32(ms)): n for ms, n in counts.items()}
+
+    def frames_for(self, ms):
+        n = self.n_frames.get(ms)
+        return to_frames(ms, self.frame_dur) if n is None else n
+
+    def _onset(self, label, target_s, t, latency=0.0):
+        # latency: from the start of drawing the screen to its onset flip
+        if self._pending is not None:
+            self._pending[4] = t - self._pending[3]
+        self.onset = t
+        self._pending = [label, self.trial, target_s, t, np.nan, latency]
+        self.events.append(self._pending)
+
+    def _flip(self, t):
+        # t is a flip time or an array of them, all belonging to the current screen
+        i, n = self.n_flips, np.size(t)
+        if i + n > len(self.flips):
+            self.flips = np.resize(self.flips, 2*(i+n))
+        self.flips['screen'][i:i+n] = len(self.events)-1
+        self.flips['t'][i:i+n] = t
+        self.n_flips = i+n
+
+    def errors(self, label=None):
+        # actual minus requested duration (s) of every completed timed screen
+        err = np.array([e[4]-e[2] for e in self.events if label in (None, e[0])], dtype=float)
+        return err[~np.isnan(err)]
+
+    def frame_report(self):
+        '''
+        Per screen label: number of flips, frame-interval percentiles (ms;
+        the interval ending at each flip counts for that flip's screen, so a
+        slow screen change shows up at the screen that was late), dropped
+        frames (intervals beyond 1.5 frames, counted in missed frames) and
+        the mean/max flip-to-onset latency (ms).
+        '''
+        flips = self.flips[:self.n_flips]
+        intervals = np.diff(flips['t'])*1000
+        labels = np.array([e[0] for e in self.events])[flips['screen'][1:]]
+        latency = np.array([e[5] for e in self.events])*1000
+        screen_labels = np.array([e[0] for e in self.events])
+        frame_ms = self.frame_dur*1000
+        rows = []
+        for label in sorted(set(screen_labels)):
+            ivs = intervals[labels == label]
+            if not len(ivs):
+                continue
+            late = ivs[ivs > 1.5*frame_ms]
+            lat = latency[screen_labels == label]
+            p50, p95, p99 = np.percentile(ivs, [50, 95, 99])
+            rows.append(dict(label=label, flips=len(ivs), p50_ms=p50, p95_ms=p95, p99_ms=p99,
+                max_ms=ivs.max(), dropped=int(np.round(late/frame_ms).sum() - len(late)),
+                latency_mean_ms=lat.mean(), latency_max_ms=lat.max()))
+        return rows
+
+    def save_frames(self, fname):
+        # frame_report() as a tsv, plus every flip next to it as <fname minus .tsv>_flips.npy
+        rows = self.frame_report()
+        columns = ['label', 'flips', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'dropped',
+                   'latency_mean_ms', 'latency_max_ms']
+        with open(fname, 'w') as f:
+            f.write("\t".join(columns)+"\n")
+            for row in rows:
+                f.write("\t".join(f"{row[c]:.3f}" if isinstance(row[c], float) else str(row[c]) for c in columns)+"\n")
+        flips = np.zeros(self.n_flips, dtype=[('label', 'S32'), ('trial', 'i2'), ('t', 'f8')])
+        flips['t'] = self.flips['t'][:self.n_flips]
+        screens = self.flips['screen'][:self.n_flips]
+        flips['label'] = np.array([e[0] for e in self.events], dtype='S32')[screens]
+        flips['trial'] = np.array([e[1] for e in self.events], dtype='i2')[screens]
+        np.save(os.path.splitext(fname)[0]+'_flips', flips)
+
+    def frame_summary(self):
+        lines = []
+        for row in self.frame_report():
+            lines.append(f"{row['label']}: flips={row['flips']} p50={row['p50_ms']:.2f}ms p95={row['p95_ms']:.2f}ms p99={row['p99_ms']:.2f}ms max={row['max_ms']:.2f}ms dropped={row['dropped']} latency={row['latency_mean_ms']:.2f}ms (max {row['latency_max_ms']:.2f}ms)")
+        return "\n".join(lines)
+
+    def summary(self):
+        labels = sorted(set(e[0] for e in self.events if not np.isnan(e[2])))
+        lines = []
+        for label in labels:
+            err = self.errors(label)*1000
+            if len(err):
+                late = np.mean(np.abs(err) > self.frame_dur*1000/2)*100
+                lines.append(f"{label}: n={len(err)} mean={err.mean():.2f}ms max={np.abs(err).max():.2f}ms off-by-a-frame={late:.1f}%")
+        return "\n".join(lines)
+
+    def save(self, fname):
+        with open(fname, 'w') as f:
+            f.write("label\ttrial\ttarget_ms\tonset_s\tactual_ms\terror_ms\tlatency_ms\n")
+            for label, trial, target_s, onset, actual_s, latency in self.events:
+                f.write(f"{label}\t{trial}\t{target_s*1000:.3f}\t{onset:.6f}\t{actual_s*1000:.3f}\t{(actual_s-target_s)*1000:.3f}\t{latency*1000:.3f}\n")
+
+class FrameTimer(FrameLog):
+    '''
+    Presents screens for whole numbers of frames on a PsychoPy window.
+    '''
+    def __init__(self, win, frame_dur, quit_key='escape'):
+        from psychopy import core, logging
+        from psychopy.hardware import keyboard
+        super().__init__(frame_dur)
+        self.win = win
+        self.quit_key = quit_key
+        self.kb = keyboard.Keyboard()
+        self._quit = core.quit
+        self._now = core.getTime # same clock as win.flip
+        self._log_level = logging.EXP
+        self._log_data = logging.data
+
+    def show(self, stims, ms=None, keys=None, on_key=None, label='', prepare=None):
+        '''
+        Draw stims every frame for ms (rounded to frames). If ms is None the
+        screen stays up until one of keys is pressed. on_key(key) is called
+        for every new key press in keys; key.rt is seconds from onset.
+        prepare() is called once right after the onset flip, to get the next
+        screen ready while this one is up; if it overruns a frame, the screen
+        ends on time with fewer flips. Returns the key presses collected
+        during the screen.
+        '''
+        n_frames = None if ms is None else self.frames_for(ms)
+        target_s = np.nan if n_frames is None else n_frames * self.frame_dur
+        pressed = []
+        frame = 0
+        requested = self._now()
+        while n_frames is None or frame < n_frames:
+            for stim in stims:
+                stim.draw()
+            if frame == 0:
+                self.win.callOnFlip(self.kb.clock.reset)
+                self.win.callOnFlip(self.kb.clearEvents)
+                self.win.logOnFlip(f"screen: onset = {label}", level=self._log_level)
+            t = self.win.flip()
+            if frame == 0:
+                self._onset(label, target_s, t, t - requested)
+            self._flip(t)
+            if frame == 0 and prepare is not None:
+                prepare()
+            # index of the frame the next flip lands on, from the clock rather than the flip count
+            frame = max(frame+1, int((self._now() - self.onset)/self.frame_dur) + 1)
+            if self.kb.getKeys([self.quit_key], waitRelease=False):
+                self._quit()
+            if keys:
+                new_keys = self.kb.getKeys(keys, waitRelease=False)
+                for key in new_keys:
+                    # Keyboard doesn't log presses itself; time-stamped when the key went down
+                    self._log_data(f"Keypress: {key.name}", t=key.tDown)
+                pressed += new_keys
+                if on_key is not None:
+                    for key in new_keys:
+                        on_key(key)
+                if n_frames is None and new_keys:
+                    break
+        return pressed